@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import statistics
+from time import perf_counter
+
+import httpx
+
+import resultados
+
+# dispara requisições concorrentes contra os endpoints analíticos da api.
+# para medir o caminho até o banco, suba a api com CACHE_TTL=0.
+ENDPOINTS = ["/origem-leads", "/matricula-lead", "/taxa-conversao", "/inadimplencia", "/dashboard"]
+
+
+def resumir(latencias, erros, duracao):
+    # latências em milissegundos; vazão em requisições por segundo
+    if len(latencias) < 2:
+        return {"requisicoes": len(latencias), "erros": erros}
+
+    percentis = statistics.quantiles(latencias, n=100, method="inclusive")
+    return {
+        "requisicoes": len(latencias),
+        "erros": erros,
+        "p50_ms": percentis[49],
+        "p95_ms": percentis[94],
+        "p99_ms": percentis[98],
+        "media_ms": statistics.fmean(latencias),
+        "max_ms": max(latencias),
+        "vazao_rps": len(latencias) / duracao,
+    }
+
+
+async def medir_endpoint(cliente, endpoint, params, requisicoes, concorrencia):
+    latencias = []
+    erros = 0
+    fila = iter(range(requisicoes))
+
+    async def trabalhador():
+        nonlocal erros
+        for _ in fila:
+            comeco = perf_counter()
+            try:
+                resposta = await cliente.get(endpoint, params=params)
+                ok = resposta.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencias.append((perf_counter() - comeco) * 1000)
+            else:
+                erros += 1
+
+    comeco = perf_counter()
+    await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+    return resumir(latencias, erros, perf_counter() - comeco)
+
+
+async def executar(args):
+    params = {"periodo": args.periodo, "tempo_real": str(args.tempo_real).lower()}
+    limites = httpx.Limits(max_connections=args.concorrencia, max_keepalive_connections=args.concorrencia)
+    metricas = {}
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=args.timeout) as cliente:
+        for endpoint in args.endpoints:
+            # aquecimento: abre as conexões e popula o cache quando ele está ligado
+            await medir_endpoint(cliente, endpoint, params, args.aquecimento, args.concorrencia)
+            metricas[endpoint] = await medir_endpoint(
+                cliente, endpoint, params, args.requisicoes, args.concorrencia
+            )
+            print(endpoint, metricas[endpoint])
+    return metricas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mede latência e vazão dos endpoints analíticos")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("--requisicoes", type=int, default=500, help="requisições medidas por endpoint")
+    parser.add_argument("--concorrencia", type=int, default=16)
+    parser.add_argument("--aquecimento", type=int, default=20)
+    parser.add_argument("--periodo", type=int, default=6)
+    parser.add_argument("--tempo-real", action="store_true", help="consulta as tabelas fato")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    metricas = asyncio.run(executar(args))
+    parametros = {chave: valor for chave, valor in vars(args).items()}
+    caminho = resultados.salvar("api", parametros, metricas)
+    print(f"resultados em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import importlib
+import math
+import os
+import sys
+from datetime import date
+
+# confere o cubo em memória (cubo.py) contra as consultas sql (consultas.py)
+# no mesmo banco: para cada intervalo, granularidade e tempo_real, as quatro
+# análises têm de dar a mesma resposta. contagens e a ordem das origens (da
+# maior para a menor, empates pelo nome) são comparadas exatamente; os valores
+# em reais são somas de float feitas em outra ordem e podem diferir nos
+# últimos bits, então são comparados com tolerância relativa.
+
+TOLERANCIA = 1e-9
+
+INTERVALOS = [
+    (date(2023, 1, 1), None),
+    (date(2024, 1, 15), None),
+    (date(2023, 3, 3), date(2024, 2, 10)),
+    (date(2024, 6, 1), date(2024, 6, 30)),
+    (date(2025, 1, 15), date(2025, 3, 10)),
+    (date(2025, 2, 3), date(2025, 2, 20)),
+    (date(2024, 12, 31), date(2025, 1, 1)),
+    (date(2020, 1, 1), date(2030, 1, 1)),
+]
+
+
+def _pacote():
+    # a api é um pacote (imports relativos) com o nome da pasta, ex.: api-infly
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(raiz))
+    nome = os.path.basename(raiz)
+    return [importlib.import_module(f"{nome}.{modulo}") for modulo in ("consultas", "cubo", "database")]
+
+
+def iguais(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(iguais(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(iguais(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return math.isclose(a, b, rel_tol=TOLERANCIA, abs_tol=TOLERANCIA)
+    return a == b
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Confere o cubo em memória contra as consultas sql")
+    parser.add_argument("--url", help="banco do warehouse (padrão: DATABASE_URL)")
+    args = parser.parse_args(argv)
+    if args.url:
+        os.environ["DATABASE_URL"] = args.url
+    consultas, cubo, database = _pacote()
+
+    from sqlalchemy.orm import Session
+
+    with database.engine_leitura.connect() as conn:
+        atual = cubo.carregar(conn, None)
+
+    comparacoes = 0
+    diferencas = 0
+    with Session(database.engine_leitura) as db:
+        for data_inicio, data_fim in INTERVALOS:
+            for tempo_real in (False, True):
+                casos = [("origem_leads", {})] + [
+                    (nome, {"granularidade": granularidade})
+                    for nome in ("matricula_lead", "taxa_conversao", "inadimplencia")
+                    for granularidade in consultas.GRANULARIDADES
+                ]
+                for nome, argumentos in casos:
+                    sql = getattr(consultas, nome)(db, data_inicio, data_fim, tempo_real, **argumentos)
+                    memoria = cubo.ANALISES[nome.replace("_", "-")](
+                        atual, data_inicio, data_fim, tempo_real, **argumentos
+                    )
+                    comparacoes += 1
+                    if not iguais(sql, memoria):
+                        diferencas += 1
+                        print(f"diferente: {nome} {data_inicio} {data_fim} tempo_real={tempo_real} {argumentos}")
+
+    print(f"{comparacoes} comparações, {diferencas} diferentes")
+    return 1 if diferencas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
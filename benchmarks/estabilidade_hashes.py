@@ -0,0 +1,89 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "etl"))
+
+import etl
+from carga import hashes_por_chave
+
+# confere, sem banco, as propriedades de que a carga incremental/diferencial
+# depende para gravar só as linhas alteradas: o hash de cada chave não muda
+# com a ordem das linhas nem com os tipos que cada lote recebe (inteiros
+# compactados em larguras diferentes, category ou texto) e muda quando um valor
+# muda. o pedido sem itens (chave nula) fica no lote, como na carga completa,
+# e sem hash.
+
+
+def extracao(n, semente=0):
+    # resultado sintético de item_query: n itens, três por pedido, e no fim um
+    # pedido sem itens, com as colunas do item nulas pelo LEFT JOIN (e por
+    # isso float, como o pandas as lê da origem)
+    rng = np.random.default_rng(semente)
+    itens = pd.DataFrame({
+        "id_pedido": np.append(np.arange(n) // 3 + 1, n // 3 + 2),
+        "id_item_pedido": np.arange(n + 1) + 1.0,
+        "tipo_pedido": rng.choice(["VENDA", "TROCA", None], n + 1),
+        "id_cliente": rng.integers(1, 500, n + 1),
+        "id_vendedor": rng.integers(1, 50, n + 1),
+        "id_condicao_pagamento": rng.integers(1, 5, n + 1),
+        "data_pedido": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 700, n + 1), unit="D"),
+        "valor_total_pedido": rng.random(n + 1) * 1000,
+        "id_produto": rng.integers(1, 200, n + 1).astype("float64"),
+        "quantidade_produto": rng.integers(1, 10, n + 1).astype("float64"),
+        "valor_produto": rng.random(n + 1) * 100,
+    })
+    itens.loc[n, ["id_item_pedido", "id_produto", "quantidade_produto", "valor_produto"]] = np.nan
+    return itens
+
+
+def transformar(itens):
+    calendario = etl.Calendario(pd.DataFrame(columns=["id", "data"]))
+    return etl.transformar_itens(itens.copy(), calendario)["f_pedido_item"]
+
+
+def hashes(df):
+    return hashes_por_chave(df, "f_pedido_item", "id").set_index("chave")["hash"]
+
+
+def main():
+    itens = extracao(30000)
+    base = hashes(transformar(itens))
+    falhas = []
+
+    if len(base) != 30000:
+        falhas.append(f"esperadas 30000 chaves, vieram {len(base)}")
+
+    embaralhado = transformar(itens.sample(frac=1, random_state=1))
+    if not hashes(embaralhado).sort_index().equals(base.sort_index()):
+        falhas.append("a ordem das linhas mudou os hashes")
+
+    # um lote pequeno compacta os ids em inteiros mais estreitos que o lote inteiro
+    pequeno = transformar(itens.head(100))
+    if pequeno["id"].dtype == transformar(itens)["id"].dtype:
+        falhas.append("o lote pequeno não mudou a largura dos ids; o teste não confere nada")
+    hashes_pequeno = hashes(pequeno)
+    if not hashes_pequeno.equals(base.loc[hashes_pequeno.index]):
+        falhas.append("a largura dos inteiros mudou os hashes")
+
+    texto = transformar(itens)
+    texto["tipo_pedido"] = texto["tipo_pedido"].astype(object)
+    if not hashes(texto).equals(base):
+        falhas.append("category e texto deram hashes diferentes")
+
+    alterado = itens.copy()
+    alterado.loc[10, "valor_produto"] += 1
+    diferentes = hashes(transformar(alterado)).compare(base).index.tolist()
+    if diferentes != [11]:
+        falhas.append(f"alterar o item 11 mudou os hashes de {diferentes}")
+
+    for falha in falhas:
+        print(f"falha: {falha}")
+    print(f"{len(base)} chaves, {len(falhas)} falhas")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "etl"))
+
+import etl
+
+import resultados
+
+# roda o etl completo (ou incremental) e guarda o tempo de cada etapa.
+# os argumentos depois de "--" vão direto para o etl.py.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mede o tempo de cada etapa do etl")
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("argumentos_etl", nargs=argparse.REMAINDER,
+                        help="repassados ao etl.py, ex.: -- --incremental --workers 8")
+    args = parser.parse_args(argv)
+    argumentos_etl = [a for a in args.argumentos_etl if a != "--"]
+
+    execucoes = []
+    for _ in range(args.repeticoes):
+        comeco = perf_counter()
+        retorno = etl.main(argumentos_etl)
+        total = perf_counter() - comeco
+        execucoes.append({
+            "total_s": total,
+            "tempos_s": retorno["tempos"],
+            "linhas": dict(retorno["linhas"]),
+            "lotes": retorno["lotes"],
+            "alteracoes": retorno["alteracoes"],
+            "linhas_por_s": sum(retorno["linhas"].values()) / total if total else 0,
+        })
+
+    # com várias repetições, o melhor tempo de cada etapa é o mais estável
+    metricas = {
+        "total_s": min(e["total_s"] for e in execucoes),
+        "linhas_por_s": max(e["linhas_por_s"] for e in execucoes),
+        "etapas_s": {
+            etapa: min(e["tempos_s"].get(etapa, 0.0) for e in execucoes)
+            for etapa in execucoes[0]["tempos_s"]
+        },
+        "linhas": execucoes[0]["linhas"],
+        "lotes": execucoes[0]["lotes"],
+        # por repetição: a partir da segunda, a diferencial só encontra o que mudou na origem
+        "alteracoes": [e["alteracoes"] for e in execucoes],
+    }
+    parametros = {"repeticoes": args.repeticoes, "argumentos_etl": argumentos_etl}
+    caminho = resultados.salvar("etl", parametros, metricas)
+
+    for etapa, segundos in metricas["etapas_s"].items():
+        print(f"{etapa:<15} {segundos:10.3f}s")
+    print(f"{'total':<15} {metricas['total_s']:10.3f}s")
+    print(f"resultados em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
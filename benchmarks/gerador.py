@@ -0,0 +1,189 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+# reaproveita o esquema, a carga via COPY e as agregações do etl
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "etl"))
+
+import esquema
+from carga import anexar_tabela, carregar_tabela, registrar_carga
+from esquema import provisionar
+from rollups import construir_rollups
+
+import resultados
+
+# warehouse sintético para medir a api e o etl sem depender da base de origem.
+# a mesma semente gera sempre os mesmos dados.
+ETAPAS = ["LEAD", "CONTATO", "NEGOCIACAO", "NEGOCIANDO", "MATRICULADO", "PERDIDO"]
+PESOS_ETAPAS = [0.35, 0.20, 0.10, 0.05, 0.15, 0.15]
+ORIGENS = ["Instagram", "Facebook", "Google", "Site", "Indicação", "WhatsApp", None]
+PESOS_ORIGENS = [0.22, 0.12, 0.20, 0.15, 0.13, 0.10, 0.08]
+FORMAS_PAGAMENTO = ["BOLETO", "PIX", "CARTAO_CREDITO", "CARTAO_DEBITO"]
+GATEWAYS = ["ASAAS", "PAGSEGURO", "STONE"]
+CATEGORIAS_CONTA = ["MENSALIDADE", "MATRICULA", "MATERIAL"]
+
+
+def chave_data(datas):
+    return (datas.year * 10000 + datas.month * 100 + datas.day).astype("int64")
+
+
+def gerar_calendario(inicio):
+    hoje = pd.Timestamp.today()
+    datas = pd.date_range(pd.Timestamp(inicio), pd.Timestamp(year=hoje.year, month=12, day=31), freq="D")
+    return pd.DataFrame({
+        "id": chave_data(datas),
+        "data": datas,
+        "ano": datas.year,
+        "mes": datas.month,
+        "dia": datas.day,
+        "nome_mes": datas.strftime("%B"),
+        "semana": datas.isocalendar().week.to_numpy(),
+        "trimestre": datas.quarter,
+    })
+
+
+def _datas(rng, inicio, dias, n):
+    return pd.DatetimeIndex(pd.Timestamp(inicio) + pd.to_timedelta(rng.integers(0, dias, n), unit="D"))
+
+
+def _chaves_opcionais(datas, nulos):
+    chaves = pd.array(chave_data(datas), dtype="Int64")
+    chaves[nulos] = pd.NA
+    return chaves
+
+
+def gerar_negociacoes(rng, primeiro_id, n, inicio, dias, clientes):
+    datas_inicio = _datas(rng, inicio, dias, n)
+    fechamento = datas_inicio + pd.to_timedelta(rng.integers(0, 90, n), unit="D")
+    return pd.DataFrame({
+        "id": np.arange(primeiro_id, primeiro_id + n, dtype="int64"),
+        "id_cliente": rng.integers(1, clientes + 1, n),
+        "id_vendedor": rng.integers(1, 51, n),
+        "etapa_negociacao": rng.choice(ETAPAS, n, p=PESOS_ETAPAS),
+        "origem_contato": rng.choice(np.array(ORIGENS, dtype=object), n, p=PESOS_ORIGENS),
+        "id_calendario_inicio": chave_data(datas_inicio),
+        "id_calendario_fechamento": _chaves_opcionais(fechamento, rng.random(n) < 0.4),
+        "id_calendario_fechamento_esperada": chave_data(datas_inicio + pd.Timedelta(days=30)),
+    })
+
+
+def gerar_contas(rng, primeiro_id, n, inicio, dias, clientes):
+    vencimento = _datas(rng, inicio, dias, n)
+    pagamento = vencimento + pd.to_timedelta(rng.integers(-5, 15, n), unit="D")
+    return pd.DataFrame({
+        "id": np.arange(primeiro_id, primeiro_id + n, dtype="int64"),
+        "id_pessoa": rng.integers(1, clientes + 1, n),
+        "id_pedido_venda": rng.integers(1, max(n // 4, 1) + 1, n),
+        "categoria_conta": rng.choice(CATEGORIAS_CONTA, n, p=[0.8, 0.1, 0.1]),
+        "forma_pagamento": rng.choice(FORMAS_PAGAMENTO, n),
+        "gateway_pagamento": rng.choice(GATEWAYS, n),
+        "tipo_conta": "RECEBER",
+        "id_calendario_pagamento": _chaves_opcionais(pagamento, rng.random(n) < 0.15),
+        "id_calendario_vencimento": chave_data(vencimento),
+        "id_calendario_emissao": chave_data(vencimento - pd.Timedelta(days=10)),
+        "despesa": "N",
+        "parcela": rng.integers(1, 13, n).astype("float64"),
+        "valor": np.round(rng.lognormal(6, 0.5, n), 2),
+    })
+
+
+def gravar(df, tabela, engine, primeiro):
+    # postgres: COPY com o ddl do etl; sqlite: to_sql
+    if engine.dialect.name == "postgresql":
+        (carregar_tabela if primeiro else anexar_tabela)(df, tabela, engine)
+    else:
+        df.to_sql(tabela, engine, if_exists="replace" if primeiro else "append", index=False, chunksize=10000)
+
+
+def registrar(inicio, engine):
+    if engine.dialect.name == "postgresql":
+        registrar_carga(inicio, engine)
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS etl_carga (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                iniciada_em TIMESTAMP NOT NULL,
+                finalizada_em TIMESTAMP NOT NULL
+            )
+        """))
+        conn.execute(
+            text("INSERT INTO etl_carga (iniciada_em, finalizada_em) VALUES (:inicio, :fim)"),
+            {"inicio": inicio, "fim": datetime.now()},
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera um warehouse sintético para os benchmarks")
+    parser.add_argument("--url", default=os.getenv("BENCH_DATABASE_URL", os.getenv("DATABASE_URL")),
+                        help="url sqlalchemy do warehouse de destino (postgres ou sqlite)")
+    parser.add_argument("--negociacoes", type=int, default=1_000_000)
+    parser.add_argument("--contas", type=int, default=1_000_000)
+    parser.add_argument("--clientes", type=int, default=None,
+                        help="clientes distintos (padrão: um terço das negociações)")
+    parser.add_argument("--anos", type=int, default=3, help="anos de histórico antes de hoje")
+    parser.add_argument("--lote", type=int, default=200_000, help="linhas geradas e gravadas por vez")
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if not args.url:
+        parser.error("informe --url ou defina BENCH_DATABASE_URL")
+
+    engine = create_engine(args.url)
+    rng = np.random.default_rng(args.semente)
+    clientes = args.clientes or max(args.negociacoes // 3, 1)
+
+    hoje = pd.Timestamp.today().normalize()
+    inicio = pd.Timestamp(year=hoje.year - args.anos, month=1, day=1)
+    dias = (hoje - inicio).days + 1
+
+    inicio_carga = datetime.now()
+    tempos = {}
+
+    comeco = perf_counter()
+    gravar(gerar_calendario(inicio), "d_calendario", engine, primeiro=True)
+    tempos["d_calendario"] = perf_counter() - comeco
+
+    geradores = {"f_negociacao": (gerar_negociacoes, args.negociacoes), "f_conta": (gerar_contas, args.contas)}
+    for tabela, (gerar, total) in geradores.items():
+        comeco = perf_counter()
+        for primeiro_id in range(0, max(total, 1), args.lote):
+            n = min(args.lote, total - primeiro_id)
+            df = gerar(rng, primeiro_id + 1, n, inicio, dias, clientes)
+            gravar(df[list(esquema.tabelas[tabela])], tabela, engine, primeiro=primeiro_id == 0)
+            print(f"{tabela}: {primeiro_id + n}/{total} linhas")
+        tempos[tabela] = perf_counter() - comeco
+
+    comeco = perf_counter()
+    construir_rollups(engine)
+    tempos["agregacoes"] = perf_counter() - comeco
+
+    if engine.dialect.name == "postgresql":
+        comeco = perf_counter()
+        provisionar(engine)
+        tempos["indices"] = perf_counter() - comeco
+
+    registrar(inicio_carga, engine)
+
+    parametros = {
+        "dialeto": engine.dialect.name,
+        "negociacoes": args.negociacoes,
+        "contas": args.contas,
+        "clientes": clientes,
+        "anos": args.anos,
+        "lote": args.lote,
+        "semente": args.semente,
+    }
+    caminho = resultados.salvar("gerador", parametros, {"tempos": tempos})
+    print(f"warehouse sintético pronto; tempos em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
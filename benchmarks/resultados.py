@@ -0,0 +1,90 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+PASTA_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(PASTA_RESULTADOS),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def salvar(tipo, parametros, metricas, caminho=None):
+    # grava uma execução em benchmarks/resultados/<tipo>-<data>.json
+    agora = datetime.now()
+    execucao = {
+        "tipo": tipo,
+        "executado_em": agora.isoformat(timespec="seconds"),
+        "commit": _commit_atual(),
+        "python": sys.version.split()[0],
+        "plataforma": platform.platform(),
+        "parametros": parametros,
+        "metricas": metricas,
+    }
+
+    if caminho is None:
+        os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+        caminho = os.path.join(PASTA_RESULTADOS, f"{tipo}-{agora:%Y%m%d-%H%M%S}.json")
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        json.dump(execucao, arquivo, indent=2, ensure_ascii=False)
+    return caminho
+
+
+def carregar(caminho):
+    with open(caminho, encoding="utf-8") as arquivo:
+        return json.load(arquivo)
+
+
+def _achatar(metricas, prefixo=""):
+    # {"a": {"p95": 1}} -> {"a.p95": 1}, só com os valores numéricos
+    planas = {}
+    for chave, valor in metricas.items():
+        nome = f"{prefixo}{chave}"
+        if isinstance(valor, dict):
+            planas.update(_achatar(valor, f"{nome}."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planas[nome] = valor
+    return planas
+
+
+def comparar(caminho_base, caminho_novo):
+    base, novo = carregar(caminho_base), carregar(caminho_novo)
+    if base["tipo"] != novo["tipo"]:
+        raise ValueError(f"execuções de tipos diferentes: {base['tipo']} x {novo['tipo']}")
+
+    metricas_base, metricas_novo = _achatar(base["metricas"]), _achatar(novo["metricas"])
+    linhas = []
+    for nome in sorted(metricas_base.keys() & metricas_novo.keys()):
+        antes, depois = metricas_base[nome], metricas_novo[nome]
+        variacao = (depois - antes) / antes * 100 if antes else None
+        linhas.append((nome, antes, depois, variacao))
+    return linhas
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) != 2:
+        print("uso: python benchmarks/resultados.py <base.json> <novo.json>")
+        sys.exit(2)
+
+    linhas = comparar(*argv)
+    largura = max((len(nome) for nome, *_ in linhas), default=10)
+    print(f"{'métrica':<{largura}}  {'base':>12}  {'novo':>12}  {'variação':>9}")
+    for nome, antes, depois, variacao in linhas:
+        texto = f"{variacao:+.1f}%" if variacao is not None else "-"
+        print(f"{nome:<{largura}}  {antes:>12.4f}  {depois:>12.4f}  {texto:>9}")
+
+
+if __name__ == "__main__":
+    main()
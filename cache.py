@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_ITENS = int(os.getenv("CACHE_MAX_ITENS", "512"))
+# intervalo mínimo (em segundos) entre consultas à versão da carga
+CACHE_INTERVALO_VERSAO = int(os.getenv("CACHE_INTERVALO_VERSAO", "30"))
+
+
+class CacheRespostas:
+    # cache ttl + lru das respostas analíticas, invalidado a cada nova carga do etl
+
+    def __init__(self, ttl=CACHE_TTL, max_itens=CACHE_MAX_ITENS, intervalo_versao=CACHE_INTERVALO_VERSAO):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.intervalo_versao = intervalo_versao
+        self.versao = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidacoes = 0
+        self.coalescidas = 0
+        self._itens = OrderedDict()
+        # cálculos em andamento por (versão, chave): quem chega durante o
+        # cálculo, na mesma versão da carga, espera o mesmo resultado
+        self._em_calculo = {}
+        self._versao_verificada_em = None
+        self._lock = threading.Lock()
+
+    def versao_expirada(self):
+        return (
+            self._versao_verificada_em is None
+            or time.monotonic() - self._versao_verificada_em >= self.intervalo_versao
+        )
+
+    def atualizar_versao(self, versao):
+        with self._lock:
+            self._versao_verificada_em = time.monotonic()
+            if versao != self.versao:
+                if self._itens:
+                    self.invalidacoes += 1
+                self._itens.clear()
+                self.versao = versao
+
+    async def verificar_versao(self, db: AsyncSession):
+        if self.versao_expirada():
+            resultado = await db.execute(select(func.max(models.CargaWarehouse.id)))
+            self.atualizar_versao(resultado.scalar())
+        return self.versao
+
+    def obter(self, chave):
+        # (versão da carga sob a qual o valor foi calculado, valor) ou None
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or time.monotonic() >= item[0]:
+                if item is not None:
+                    del self._itens[chave]
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return item[1:]
+
+    def guardar(self, chave, valor, versao):
+        # um resultado calculado sob uma versão já substituída não entra no
+        # cache da nova carga
+        with self._lock:
+            if versao != self.versao:
+                return
+            self._itens[chave] = (time.monotonic() + self.ttl, versao, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    async def obter_ou_calcular(self, db: AsyncSession, chave, calcular):
+        # calcular recebe a sessão síncrona subjacente (via run_sync). devolve
+        # (versão, valor): a versão é a da carga sob a qual o valor foi
+        # calculado, que pode ser anterior à atual (ver main.resposta_condicional)
+        versao = await self.verificar_versao(db)
+        em_calculo = (versao, chave)
+        while True:
+            item = self.obter(chave)
+            if item is not None:
+                return item
+
+            futuro = self._em_calculo.get(em_calculo)
+            if futuro is None:
+                break
+            # outra requisição já está calculando esta chave (após uma
+            # invalidação ou expiração): espera o resultado dela em vez de
+            # repetir a consulta
+            self.coalescidas += 1
+            try:
+                return await asyncio.shield(futuro)
+            except asyncio.CancelledError:
+                # o cálculo foi cancelado (cliente desconectou): tenta de novo
+                if not futuro.cancelled():
+                    raise
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._em_calculo[em_calculo] = futuro
+        try:
+            valor = await db.run_sync(calcular)
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as exc:
+            futuro.set_exception(exc)
+            # marca a exceção como lida: pode não haver ninguém esperando
+            futuro.exception()
+            raise
+        finally:
+            del self._em_calculo[em_calculo]
+        self.guardar(chave, valor, versao)
+        futuro.set_result((versao, valor))
+        return versao, valor
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._versao_verificada_em = None
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "versao_carga": self.versao,
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidacoes": self.invalidacoes,
+                "coalescidas": self.coalescidas,
+                "taxa_acerto": round(self.hits / total * 100, 2) if total else 0,
+            }
+
+
+def etag(versao, chave):
+    # etag forte: muda a cada carga do etl e com os parâmetros da requisição
+    return '"' + hashlib.sha256(repr((versao, chave)).encode()).hexdigest()[:32] + '"'
@@ -0,0 +1,502 @@
+import calendar
+from datetime import date, timedelta
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, or_, and_, false, tuple_
+
+from . import models
+
+# as consultas leem por padrão as agregações mensais (r_*) geradas pelo etl
+# para os meses inteiros do intervalo; as pontas que cortam um mês no meio vão
+# às tabelas fato, para que o resultado seja o do intervalo pedido. com
+# tempo_real=True elas varrem só as tabelas fato.
+#
+# as chaves de d_calendario são aaaammdd, então dia, mês e ano saem da própria
+# chave (chave // 100 etc.) sem junção; semana e trimestre vêm das colunas de
+# d_calendario.
+#
+# data_fim=None deixa o intervalo aberto: as séries vão até hoje ou até o
+# último período com dados, o que vier depois.
+
+GRANULARIDADES = ("dia", "semana", "mes", "trimestre", "ano")
+
+
+def _chave_data(d):
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def _chave_mes(d):
+    return d.year * 100 + d.month
+
+
+def _nome_mes(ano, mes):
+    return date(ano, mes, 1).strftime("%B")
+
+
+# períodos: cada granularidade identifica o período por uma tupla de inteiros,
+# a mesma no sql e no python
+
+
+def _colunas_periodo(chave, granularidade):
+    c = models.Calendario
+    if granularidade == "dia":
+        return [chave]
+    if granularidade == "mes":
+        return [chave // 10000, chave // 100 % 100]
+    if granularidade == "ano":
+        return [chave // 10000]
+    if granularidade == "trimestre":
+        return [c.ano, c.trimestre]
+    # semana iso: os primeiros dias de janeiro podem pertencer à última
+    # semana do ano anterior, e os últimos de dezembro à semana 1 do seguinte
+    ano_iso = c.ano + case(
+        ((c.mes == 1) & (c.semana >= 52), -1),
+        ((c.mes == 12) & (c.semana == 1), 1),
+        else_=0
+    )
+    return [ano_iso, c.semana]
+
+
+def _usa_calendario(granularidade):
+    return granularidade in ("semana", "trimestre")
+
+
+# chave_periodo até serie_esparsa, e_matricula e as funções linhas_* também
+# montam as respostas do cubo em memória (cubo.py)
+def chave_periodo(d, granularidade):
+    if granularidade == "dia":
+        return (_chave_data(d),)
+    if granularidade == "semana":
+        ano, semana, _ = d.isocalendar()
+        return (ano, semana)
+    if granularidade == "mes":
+        return (d.year, d.month)
+    if granularidade == "trimestre":
+        return (d.year, (d.month - 1) // 3 + 1)
+    return (d.year,)
+
+
+def inicio_periodo(periodo, granularidade):
+    if granularidade == "dia":
+        ano, resto = divmod(periodo[0], 10000)
+        return date(ano, *divmod(resto, 100))
+    if granularidade == "semana":
+        return date.fromisocalendar(periodo[0], periodo[1], 1)
+    if granularidade == "mes":
+        return date(periodo[0], periodo[1], 1)
+    if granularidade == "trimestre":
+        return date(periodo[0], periodo[1] * 3 - 2, 1)
+    return date(periodo[0], 1, 1)
+
+
+def proximo_inicio(inicio, granularidade):
+    # None depois do último período que cabe em date (date.max)
+    dias = {"dia": 1, "semana": 7}.get(granularidade)
+    if dias is not None:
+        if (date.max - inicio).days < dias:
+            return None
+        return inicio + timedelta(days=dias)
+    meses = {"mes": 1, "trimestre": 3, "ano": 12}[granularidade]
+    ano, mes = divmod(inicio.month - 1 + meses, 12)
+    if inicio.year + ano > date.max.year:
+        return None
+    return date(inicio.year + ano, mes + 1, 1)
+
+
+def _fim_mes(d):
+    return d.replace(day=calendar.monthrange(d.year, d.month)[1])
+
+
+def numero_periodos(data_inicio, data_fim, granularidade):
+    # tamanho da série densa de data_inicio até data_fim (ou hoje)
+    fim = data_fim or date.today()
+    if fim < data_inicio:
+        return 0
+    inicio = inicio_periodo(chave_periodo(data_inicio, granularidade), granularidade)
+    fim = inicio_periodo(chave_periodo(fim, granularidade), granularidade)
+    if granularidade in ("dia", "semana"):
+        return (fim - inicio).days // (7 if granularidade == "semana" else 1) + 1
+    meses = (fim.year - inicio.year) * 12 + fim.month - inicio.month
+    return meses // {"mes": 1, "trimestre": 3, "ano": 12}[granularidade] + 1
+
+
+def _agrupar(consulta, periodo):
+    # separa as colunas do período (uma tupla) dos valores agregados
+    n = len(periodo)
+    return [
+        (tuple(int(v) for v in linha[:n]), tuple(linha[n:]))
+        for linha in consulta.group_by(*periodo).all()
+    ]
+
+
+def serie_densa(linhas, data_inicio, data_fim, granularidade, vazio):
+    # série contínua de (início do período, valores), com `vazio` nos períodos
+    # do intervalo que não aparecem no resultado
+    por_periodo = dict(linhas)
+    fim = data_fim or date.today()
+    if por_periodo:
+        fim = max(fim, max(inicio_periodo(p, granularidade) for p in por_periodo))
+
+    serie = []
+    inicio = inicio_periodo(chave_periodo(data_inicio, granularidade), granularidade)
+    while inicio is not None and inicio <= fim:
+        serie.append((inicio, por_periodo.get(chave_periodo(inicio, granularidade), vazio)))
+        inicio = proximo_inicio(inicio, granularidade)
+    return serie
+
+
+def serie_esparsa(linhas, granularidade):
+    # só os períodos com dados, em ordem
+    return sorted((inicio_periodo(p, granularidade), valores) for p, valores in linhas)
+
+
+def _filtro_chave(coluna, data_inicio, data_fim):
+    filtros = [coluna >= _chave_data(data_inicio)]
+    if data_fim is not None:
+        filtros.append(coluna <= _chave_data(data_fim))
+    return filtros
+
+
+def _filtro_mes(r, primeiro, ultimo):
+    # meses inteiros [primeiro, ultimo] das agregações (ver _faixas)
+    filtros = [r.ano * 100 + r.mes >= _chave_mes(primeiro)]
+    if ultimo is not None:
+        filtros.append(r.ano * 100 + r.mes <= _chave_mes(ultimo))
+    return filtros
+
+
+def _faixas(data_inicio, data_fim, agregado):
+    # divide o intervalo em (meses inteiros lidos das agregações, faixas lidas
+    # das tabelas fato). os meses inteiros são (primeiro, ultimo) ou None;
+    # ultimo=None mantém o intervalo aberto. sem `agregado`, tudo vai às fato.
+    if not agregado:
+        return None, [(data_inicio, data_fim)]
+
+    faixas = []
+    primeiro = data_inicio.replace(day=1)
+    if data_inicio != primeiro:
+        fim_mes = _fim_mes(primeiro)
+        if fim_mes == date.max or (data_fim is not None and data_fim <= fim_mes):
+            return None, [(data_inicio, data_fim)]
+        faixas.append((data_inicio, fim_mes))
+        primeiro = fim_mes + timedelta(days=1)
+
+    if data_fim is None:
+        return (primeiro, None), faixas
+
+    ultimo = data_fim
+    inicio_ultimo = data_fim.replace(day=1)
+    if _fim_mes(data_fim) != data_fim:
+        faixas.append((max(inicio_ultimo, primeiro), data_fim))
+        if inicio_ultimo <= primeiro:
+            return None, faixas
+        ultimo = inicio_ultimo - timedelta(days=1)
+    if ultimo < primeiro:
+        return None, faixas
+    return (primeiro, ultimo), faixas
+
+
+def _somar_periodos(partes):
+    # junta listas (período, valores) somando os valores de um mesmo período
+    totais = {}
+    for parte in partes:
+        for periodo, valores in parte:
+            anteriores = totais.get(periodo)
+            if anteriores is not None:
+                valores = tuple((a or 0) + (b or 0) for a, b in zip(anteriores, valores))
+            totais[periodo] = valores
+    return list(totais.items())
+
+
+def _campos_periodo(inicio):
+    return {
+        "inicio": inicio,
+        "ano": inicio.year,
+        "mes": inicio.month,
+        "nome_mes": _nome_mes(inicio.year, inicio.month),
+    }
+
+
+def _origens_fatos(db: Session, data_inicio, data_fim):
+    n = models.Negociacao
+    return (
+        db.query(n.origem_contato, func.count(n.id))
+        .filter(*_filtro_chave(n.id_calendario_inicio, data_inicio, data_fim))
+        .group_by(n.origem_contato)
+        .all()
+    )
+
+
+def _origens_rollup(db: Session, primeiro, ultimo):
+    r = models.NegociacaoOrigemMensal
+    return (
+        db.query(r.origem_contato, func.sum(r.total_negociacoes))
+        .filter(*_filtro_mes(r, primeiro, ultimo))
+        .group_by(r.origem_contato)
+        .all()
+    )
+
+
+def _somar_origens(partes):
+    # negociações por origem, da maior para a menor (empates pelo nome)
+    quantidades = {}
+    for parte in partes:
+        for origem_contato, quantidade in parte:
+            origem_contato = origem_contato or "Não especificado"
+            quantidades[origem_contato] = quantidades.get(origem_contato, 0) + int(quantidade or 0)
+    return sorted(quantidades.items(), key=lambda item: (-item[1], item[0]))
+
+
+def origem_leads(db: Session, data_inicio, data_fim=None, tempo_real=False):
+    data_fim = data_fim or date.today()
+    meses, faixas = _faixas(data_inicio, data_fim, not tempo_real)
+    partes = [_origens_fatos(db, inicio, fim) for inicio, fim in faixas]
+    if meses:
+        partes.append(_origens_rollup(db, *meses))
+    return linhas_origem_leads(_somar_origens(partes))
+
+
+def linhas_origem_leads(resultados):
+    return [
+        {
+            "lead": origem_contato or "Não especificado",
+            "quantidade": int(quantidade or 0)
+        }
+        for origem_contato, quantidade in resultados
+    ]
+
+
+def e_matricula(n):
+    return or_(
+        n.etapa_negociacao.like("NEGOCIA%"),
+        n.etapa_negociacao == "MATRICULADO"
+    )
+
+
+def _leads_matriculas_fatos(db: Session, data_inicio, data_fim, granularidade):
+    n = models.Negociacao
+    matricula = e_matricula(n)
+
+    # leads e matriculas por período numa única varredura
+    periodo = _colunas_periodo(n.id_calendario_inicio, granularidade)
+    consulta = db.query(
+        *periodo,
+        func.count(func.distinct(n.id_cliente)),
+        func.count(n.id).filter(matricula)
+    ).select_from(n)
+    if _usa_calendario(granularidade):
+        consulta = consulta.join(models.Calendario, models.Calendario.id == n.id_calendario_inicio)
+    consulta = consulta.filter(*_filtro_chave(n.id_calendario_inicio, data_inicio, data_fim))
+    return _agrupar(consulta, periodo)
+
+
+def _leads_matriculas_rollup(db: Session, primeiro, ultimo):
+    r = models.NegociacaoMensal
+    consulta = (
+        db.query(r.ano, r.mes, r.total_clientes, r.total_matriculas)
+        .filter(*_filtro_mes(r, primeiro, ultimo))
+    )
+    return _agrupar(consulta, [r.ano, r.mes])
+
+
+def leads_matriculas(db: Session, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+    # série contínua de (início do período, (total_leads, total_matriculas)).
+    # leads são clientes distintos, que não se somam entre meses: fora da
+    # granularidade mensal a consulta vai sempre às tabelas fato. na mensal,
+    # cada ponta parcial é um mês à parte e não se mistura com as agregações.
+    meses, faixas = _faixas(data_inicio, data_fim, not tempo_real and granularidade == "mes")
+    linhas = []
+    if meses:
+        linhas += _leads_matriculas_rollup(db, *meses)
+    for inicio, fim in faixas:
+        linhas += _leads_matriculas_fatos(db, inicio, fim, granularidade)
+    return serie_densa(linhas, data_inicio, data_fim, granularidade, (0, 0))
+
+
+def linhas_matricula_lead(serie):
+    return [
+        {
+            **_campos_periodo(inicio),
+            "total_leads": int(total_leads or 0),
+            "total_matriculas": int(total_matriculas or 0)
+        }
+        for inicio, (total_leads, total_matriculas) in serie
+    ]
+
+
+def linhas_taxa_conversao(serie):
+    resposta = []
+    for inicio, (total_leads, total_matriculas) in serie:
+        total_leads = int(total_leads or 0)
+        total_matriculas = int(total_matriculas or 0)
+        taxa = (total_matriculas / total_leads * 100) if total_leads > 0 else 0
+
+        resposta.append({
+            **_campos_periodo(inicio),
+            "total_leads": total_leads,
+            "total_matriculas": total_matriculas,
+            "taxa_conversao": round(taxa, 2)
+        })
+
+    return resposta
+
+
+def matricula_lead(db: Session, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+    return linhas_matricula_lead(leads_matriculas(db, data_inicio, data_fim, tempo_real, granularidade))
+
+
+def taxa_conversao(db: Session, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+    return linhas_taxa_conversao(leads_matriculas(db, data_inicio, data_fim, tempo_real, granularidade))
+
+
+def _inadimplencia_fatos(db: Session, data_inicio, data_fim, granularidade):
+    co = models.Conta
+    periodo = _colunas_periodo(co.id_calendario_vencimento, granularidade)
+    consulta = db.query(
+        *periodo,
+        func.sum(co.valor),
+        func.sum(case((co.id_calendario_pagamento != None, co.valor), else_=0)),
+        func.sum(case((co.id_calendario_pagamento == None, co.valor), else_=0))
+    ).select_from(co)
+    if _usa_calendario(granularidade):
+        consulta = consulta.join(models.Calendario, models.Calendario.id == co.id_calendario_vencimento)
+    consulta = consulta.filter(*_filtro_chave(co.id_calendario_vencimento, data_inicio, data_fim))
+    return _agrupar(consulta, periodo)
+
+
+def _inadimplencia_rollup(db: Session, primeiro, ultimo, granularidade):
+    # somas mensais se somam em trimestres e anos
+    r = models.ContaMensal
+    periodo = {
+        "mes": [r.ano, r.mes],
+        "trimestre": [r.ano, (r.mes - 1) // 3 + 1],
+        "ano": [r.ano],
+    }[granularidade]
+    consulta = db.query(
+        *periodo,
+        func.sum(r.valor_total),
+        func.sum(r.receita_total),
+        func.sum(r.valor_inadimplente)
+    ).filter(*_filtro_mes(r, primeiro, ultimo))
+    return _agrupar(consulta, periodo)
+
+
+def inadimplencia(db: Session, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+    # as pontas parciais somam-se aos meses inteiros do mesmo trimestre/ano
+    agregado = not tempo_real and granularidade in ("mes", "trimestre", "ano")
+    meses, faixas = _faixas(data_inicio, data_fim, agregado)
+    partes = [_inadimplencia_fatos(db, inicio, fim, granularidade) for inicio, fim in faixas]
+    if meses:
+        partes.append(_inadimplencia_rollup(db, *meses, granularidade))
+    return linhas_inadimplencia(serie_esparsa(_somar_periodos(partes), granularidade))
+
+
+def linhas_inadimplencia(serie):
+    resposta = []
+    for inicio, (valor_total, receita_total, valor_inadimplente) in serie:
+        valor_total = float(valor_total or 0)
+        receita_total = float(receita_total or 0)
+        valor_inadimplente = float(valor_inadimplente or 0)
+
+        taxa_inadimplencia = (valor_inadimplente / valor_total * 100) if valor_total > 0 else 0
+        percentual_pagas = (receita_total / valor_total * 100) if valor_total > 0 else 0
+
+        resposta.append({
+            **_campos_periodo(inicio),
+            "valor_total": valor_total,
+            "receita_total": receita_total,
+            "valor_inadimplente": valor_inadimplente,
+            "taxa_inadimplencia": round(taxa_inadimplencia, 2),
+            "percentual_mensalidades_pagas": round(percentual_pagas, 2)
+        })
+
+    return resposta
+
+
+def _nas_faixas(coluna, faixas):
+    if not faixas:
+        return false()
+    return or_(*[and_(*_filtro_chave(coluna, inicio, fim)) for inicio, fim in faixas])
+
+
+def _negociacoes_fatos(db: Session, faixas_leads, faixas_origens, granularidade):
+    # leads/matrículas por período e negociações por origem numa única
+    # varredura de negociações: no postgres, GROUPING SETS agrupa as mesmas
+    # linhas pelos dois critérios, e cada agregado conta só a sua faixa.
+    # nos demais bancos são duas consultas.
+    if not faixas_leads and not faixas_origens:
+        return [], []
+    if db.get_bind().dialect.name != "postgresql":
+        linhas = []
+        for inicio, fim in faixas_leads:
+            linhas += _leads_matriculas_fatos(db, inicio, fim, granularidade)
+        origens = []
+        for inicio, fim in faixas_origens:
+            origens += _origens_fatos(db, inicio, fim)
+        return linhas, origens
+
+    n = models.Negociacao
+    em_leads = _nas_faixas(n.id_calendario_inicio, faixas_leads)
+    em_origens = _nas_faixas(n.id_calendario_inicio, faixas_origens)
+    periodo = _colunas_periodo(n.id_calendario_inicio, granularidade)
+    consulta = db.query(
+        *periodo,
+        n.origem_contato,
+        func.grouping(n.origem_contato),
+        func.count(func.distinct(n.id_cliente)).filter(em_leads),
+        func.count(n.id).filter(and_(e_matricula(n), em_leads)),
+        func.count(n.id).filter(em_leads),
+        func.count(n.id).filter(em_origens)
+    ).select_from(n)
+    if _usa_calendario(granularidade):
+        consulta = consulta.join(models.Calendario, models.Calendario.id == n.id_calendario_inicio)
+    consulta = (
+        consulta.filter(or_(em_leads, em_origens))
+        .group_by(func.grouping_sets(tuple_(*periodo), tuple_(n.origem_contato)))
+    )
+
+    # grouping(origem_contato) = 1 nas linhas por período; linhas sem
+    # negociações na faixa do seu lado são descartadas, como nas consultas
+    # separadas
+    k = len(periodo)
+    linhas, origens = [], []
+    for linha in consulta.all():
+        origem_contato, por_periodo, leads, matriculas, negociacoes, na_origem = linha[k:]
+        if por_periodo:
+            if negociacoes:
+                linhas.append((tuple(int(v) for v in linha[:k]), (leads, matriculas)))
+        elif na_origem:
+            origens.append((origem_contato, na_origem))
+    return linhas, origens
+
+
+def dashboard(db: Session, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+    # as quatro análises numa única transaction snapshot: todas enxergam a
+    # mesma carga do warehouse. as partes de negociações que vão às tabelas
+    # fato (origens e leads/matrículas, que matrícula/conversão compartilham)
+    # saem de uma única varredura. a transação aberta pela verificação de
+    # versão do cache é encerrada para que o nível de isolamento valha desde
+    # o início.
+    db.rollback()
+    nivel = "REPEATABLE READ" if db.get_bind().dialect.name == "postgresql" else "SERIALIZABLE"
+    db.connection(execution_options={"isolation_level": nivel})
+
+    meses_leads, faixas_leads = _faixas(
+        data_inicio, data_fim, not tempo_real and granularidade == "mes"
+    )
+    meses_origens, faixas_origens = _faixas(
+        data_inicio, data_fim or date.today(), not tempo_real
+    )
+    linhas, origens = _negociacoes_fatos(db, faixas_leads, faixas_origens, granularidade)
+    if meses_leads:
+        linhas += _leads_matriculas_rollup(db, *meses_leads)
+    partes_origens = [origens]
+    if meses_origens:
+        partes_origens.append(_origens_rollup(db, *meses_origens))
+
+    serie = serie_densa(linhas, data_inicio, data_fim, granularidade, (0, 0))
+    return {
+        "origem_leads": linhas_origem_leads(_somar_origens(partes_origens)),
+        "matricula_lead": linhas_matricula_lead(serie),
+        "taxa_conversao": linhas_taxa_conversao(serie),
+        "inadimplencia": inadimplencia(db, data_inicio, data_fim, tempo_real, granularidade),
+    }
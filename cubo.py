@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import case, func, select, text
+
+from . import consultas, models
+
+logger = logging.getLogger(__name__)
+
+# cubo analítico em memória (opcional): as medidas das quatro análises ficam em
+# arrays numpy indexados por dia e as respostas saem de fatias e somas, sem
+# consulta ao banco. o cubo é recarregado quando muda a versão da carga do etl.
+CUBO_ANALITICO = os.getenv("CUBO_ANALITICO", "false").lower() in ("1", "true", "sim")
+# intervalo (em segundos) entre verificações da versão da carga
+CUBO_INTERVALO = int(os.getenv("CUBO_INTERVALO", "30"))
+# após falhas seguidas, a espera dobra até este limite (em segundos)
+CUBO_INTERVALO_MAXIMO = int(os.getenv("CUBO_INTERVALO_MAXIMO", "600"))
+# ler as tabelas fato inteiras passa do DB_STATEMENT_TIMEOUT_MS das consultas; 0 desliga
+CUBO_STATEMENT_TIMEOUT_MS = int(os.getenv("CUBO_STATEMENT_TIMEOUT_MS", "0"))
+
+
+def _dias(chaves):
+    # chaves aaaammdd -> datetime64[D]
+    ano, resto = np.divmod(np.asarray(chaves, dtype=np.int64), 10000)
+    mes, dia = np.divmod(resto, 100)
+    meses = ((ano - 1970) * 12 + mes - 1).astype("datetime64[M]")
+    return meses.astype("datetime64[D]") + (dia - 1).astype("timedelta64[D]")
+
+
+def _somar(valores, inicios, dtype):
+    # soma de cada segmento [inicios[i], inicios[i + 1]) de `valores`
+    if len(valores) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.add.reduceat(valores, inicios, dtype=dtype)
+
+
+class CuboAnalitico:
+    # eixo de dias [dia0, dia0 + n_dias) com, por dia:
+    #   negociacoes por origem, matrículas e as somas das contas pelo vencimento.
+    # leads (clientes distintos) não se somam entre dias: ficam os pares
+    # (dia, cliente) ordenados e a contagem pronta de cada período completo.
+
+    def __init__(self, versao, negociacoes, pares, contas):
+        self.versao = versao
+        chaves = np.concatenate([negociacoes["chave"], pares["chave"], contas["chave"]])
+        if len(chaves) == 0:
+            self.dia0 = date.today()
+            self.n_dias = 0
+        else:
+            self.dia0 = date.fromisoformat(str(_dias([chaves.min()])[0]))
+            self.n_dias = int((_dias([chaves.max()])[0] - np.datetime64(self.dia0)).astype(int)) + 1
+
+        # negociações: contagem por (dia, origem) e matrículas por dia
+        self.origens, codigos = np.unique(negociacoes["origem"], return_inverse=True)
+        dias = self._indices(negociacoes["chave"])
+        self.por_origem = np.zeros((self.n_dias, len(self.origens)), dtype=np.int64)
+        np.add.at(self.por_origem, (dias, codigos), negociacoes["quantidade"])
+        self.negociacoes = self.por_origem.sum(axis=1)
+        self.matriculas = np.bincount(dias, negociacoes["matriculas"], minlength=self.n_dias).astype(np.int64)
+
+        # pares distintos (dia, cliente), ordenados por dia
+        dias = self._indices(pares["chave"])
+        ordem = np.argsort(dias, kind="stable")
+        self.pares_dia = dias[ordem]
+        _, self.pares_cliente = np.unique(pares["cliente"][ordem], return_inverse=True)
+        self.inicio_dia = np.searchsorted(self.pares_dia, np.arange(self.n_dias + 1))
+
+        # contas pelo dia de vencimento
+        dias = self._indices(contas["chave"])
+        self.contas = np.bincount(dias, contas["quantidade"], minlength=self.n_dias).astype(np.int64)
+        self.valor_total = np.bincount(dias, contas["valor_total"], minlength=self.n_dias)
+        self.receita_total = np.bincount(dias, contas["receita_total"], minlength=self.n_dias)
+        self.valor_inadimplente = np.bincount(dias, contas["valor_inadimplente"], minlength=self.n_dias)
+
+        # início (índice no eixo) de cada período e leads dos períodos completos
+        self.periodos = {}
+        self.leads = {}
+        for granularidade in consultas.GRANULARIDADES:
+            self.periodos[granularidade] = self._inicios_periodos(granularidade)
+            self.leads[granularidade] = self._leads_por_periodo(self.periodos[granularidade])
+
+    def _indices(self, chaves):
+        if len(chaves) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return (_dias(chaves) - np.datetime64(self.dia0)).astype(np.int64)
+
+    def _dia(self, indice):
+        return self.dia0 + timedelta(days=int(indice))
+
+    def _inicios_periodos(self, granularidade):
+        inicios = [0]
+        ultimo = self._dia(self.n_dias)
+        inicio = consultas.inicio_periodo(consultas.chave_periodo(self.dia0, granularidade), granularidade)
+        inicio = consultas.proximo_inicio(inicio, granularidade)
+        while inicio is not None and inicio < ultimo:
+            inicios.append((inicio - self.dia0).days)
+            inicio = consultas.proximo_inicio(inicio, granularidade)
+        return np.array(inicios, dtype=np.int64)
+
+    def _leads_por_periodo(self, inicios):
+        # clientes distintos por período: pares (período, cliente) únicos contados por período
+        if len(self.pares_dia) == 0:
+            return np.zeros(len(inicios), dtype=np.int64)
+        periodo = np.searchsorted(inicios, self.pares_dia, side="right") - 1
+        clientes = int(self.pares_cliente.max()) + 1
+        unicos = np.unique(periodo * clientes + self.pares_cliente)
+        return np.bincount(unicos // clientes, minlength=len(inicios))
+
+    # consultas
+
+    def _intervalo(self, data_inicio, data_fim):
+        # índices [lo, hi) do eixo cobertos pelo intervalo. o cubo é diário:
+        # `tempo_real` não muda nada, o intervalo é sempre o pedido
+        lo = min(max((data_inicio - self.dia0).days, 0), self.n_dias)
+        hi = self.n_dias if data_fim is None else min(max((data_fim - self.dia0).days + 1, 0), self.n_dias)
+        return lo, max(lo, hi)
+
+    def _segmentos(self, lo, hi, granularidade):
+        # divide [lo, hi) nos períodos da granularidade: (inícios, fins, período, completo)
+        inicios = self.periodos[granularidade]
+        primeiro = np.searchsorted(inicios, lo, side="right") - 1
+        ultimo = np.searchsorted(inicios, hi, side="left")
+        periodos = np.arange(primeiro, ultimo)
+        comecos = np.concatenate(([lo], inicios[primeiro + 1:ultimo]))
+        fins = np.concatenate((inicios[primeiro + 1:ultimo], [hi]))
+        limites = np.append(inicios, self.n_dias)
+        completos = (comecos == limites[periodos]) & (fins == limites[periodos + 1])
+        return comecos, fins, periodos, completos
+
+    def _linhas(self, comecos, granularidade, valores, manter):
+        # mesmo formato de consultas._agrupar: (período, valores)
+        return [
+            (consultas.chave_periodo(self._dia(inicio), granularidade), tuple(v[i] for v in valores))
+            for i, inicio in enumerate(comecos)
+            if manter[i]
+        ]
+
+    def origem_leads(self, data_inicio, data_fim=None, tempo_real=False):
+        lo, hi = self._intervalo(data_inicio, data_fim or date.today())
+        quantidades = self.por_origem[lo:hi].sum(axis=0)
+        ordem = np.argsort(-quantidades, kind="stable")
+        return consultas.linhas_origem_leads(
+            (self.origens[i], quantidades[i]) for i in ordem if quantidades[i] > 0
+        )
+
+    def leads_matriculas(self, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+        lo, hi = self._intervalo(data_inicio, data_fim)
+        linhas = []
+        if lo < hi:
+            comecos, fins, periodos, completos = self._segmentos(lo, hi, granularidade)
+            negociacoes = _somar(self.negociacoes[lo:hi], comecos - lo, np.int64)
+            matriculas = _somar(self.matriculas[lo:hi], comecos - lo, np.int64)
+            leads = self.leads[granularidade][periodos].copy()
+            # períodos cortados pelo intervalo (no máximo as duas pontas)
+            for i in np.flatnonzero(~completos):
+                clientes = self.pares_cliente[self.inicio_dia[comecos[i]]:self.inicio_dia[fins[i]]]
+                leads[i] = len(np.unique(clientes))
+            linhas = self._linhas(comecos, granularidade, (leads, matriculas), negociacoes > 0)
+        return consultas.serie_densa(linhas, data_inicio, data_fim, granularidade, (0, 0))
+
+    def matricula_lead(self, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+        return consultas.linhas_matricula_lead(
+            self.leads_matriculas(data_inicio, data_fim, tempo_real, granularidade)
+        )
+
+    def taxa_conversao(self, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+        return consultas.linhas_taxa_conversao(
+            self.leads_matriculas(data_inicio, data_fim, tempo_real, granularidade)
+        )
+
+    def inadimplencia(self, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+        lo, hi = self._intervalo(data_inicio, data_fim)
+        linhas = []
+        if lo < hi:
+            comecos, _, _, _ = self._segmentos(lo, hi, granularidade)
+            contas = _somar(self.contas[lo:hi], comecos - lo, np.int64)
+            valores = tuple(
+                _somar(medida[lo:hi], comecos - lo, np.float64)
+                for medida in (self.valor_total, self.receita_total, self.valor_inadimplente)
+            )
+            linhas = self._linhas(comecos, granularidade, valores, contas > 0)
+        return consultas.linhas_inadimplencia(consultas.serie_esparsa(linhas, granularidade))
+
+    def dashboard(self, data_inicio, data_fim=None, tempo_real=False, granularidade="mes"):
+        # o cubo é imutável: as quatro análises veem a mesma carga
+        serie = self.leads_matriculas(data_inicio, data_fim, tempo_real, granularidade)
+        return {
+            "origem_leads": self.origem_leads(data_inicio, data_fim, tempo_real),
+            "matricula_lead": consultas.linhas_matricula_lead(serie),
+            "taxa_conversao": consultas.linhas_taxa_conversao(serie),
+            "inadimplencia": self.inadimplencia(data_inicio, data_fim, tempo_real, granularidade),
+        }
+
+
+# mesmas chaves de main.ANALISES
+ANALISES = {
+    "origem-leads": CuboAnalitico.origem_leads,
+    "matricula-lead": CuboAnalitico.matricula_lead,
+    "taxa-conversao": CuboAnalitico.taxa_conversao,
+    "inadimplencia": CuboAnalitico.inadimplencia,
+}
+
+
+def _colunas(linhas, nomes, tipos):
+    colunas = list(zip(*linhas)) or [()] * len(nomes)
+    return {nome: np.array(valores, dtype=tipo) for nome, valores, tipo in zip(nomes, colunas, tipos)}
+
+
+def ler(conn):
+    # lê do warehouse só os agregados por dia (e os pares dia/cliente distintos)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"SET LOCAL statement_timeout = {CUBO_STATEMENT_TIMEOUT_MS}"))
+    n = models.Negociacao
+    origem = func.coalesce(n.origem_contato, "Não especificado")
+    negociacoes = conn.execute(
+        select(
+            n.id_calendario_inicio,
+            origem,
+            func.count(n.id),
+            func.count(n.id).filter(consultas.e_matricula(n)),
+        )
+        .where(n.id_calendario_inicio != None)
+        .group_by(n.id_calendario_inicio, origem)
+    ).all()
+    pares = conn.execute(
+        select(n.id_calendario_inicio, n.id_cliente)
+        .where(n.id_calendario_inicio != None, n.id_cliente != None)
+        .distinct()
+    ).all()
+
+    co = models.Conta
+    contas = conn.execute(
+        select(
+            co.id_calendario_vencimento,
+            func.count(),
+            func.sum(co.valor),
+            func.sum(case((co.id_calendario_pagamento != None, co.valor), else_=0)),
+            func.sum(case((co.id_calendario_pagamento == None, co.valor), else_=0)),
+        )
+        .where(co.id_calendario_vencimento != None)
+        .group_by(co.id_calendario_vencimento)
+    ).all()
+    return negociacoes, pares, contas
+
+
+def montar(versao, negociacoes, pares, contas):
+    # monta o cubo a partir das linhas de ler(); só cpu, fora do event loop
+    return CuboAnalitico(
+        versao,
+        _colunas(negociacoes, ["chave", "origem", "quantidade", "matriculas"],
+                 [np.int64, object, np.int64, np.int64]),
+        _colunas(pares, ["chave", "cliente"], [np.int64, np.int64]),
+        _colunas(
+            [(chave, quantidade, total or 0.0, receita or 0.0, inadimplente or 0.0)
+             for chave, quantidade, total, receita, inadimplente in contas],
+            ["chave", "quantidade", "valor_total", "receita_total", "valor_inadimplente"],
+            [np.int64, np.int64, np.float64, np.float64, np.float64],
+        ),
+    )
+
+
+def carregar(conn, versao):
+    return montar(versao, *ler(conn))
+
+
+def recarregar(engine, atual):
+    # na engine síncrona, fora do event loop: ler() materializa as linhas dos
+    # agregados e montar() é só cpu. devolve `atual` se a versão não mudou
+    with engine.connect() as conn:
+        versao = conn.execute(select(func.max(models.CargaWarehouse.id))).scalar()
+        if atual is not None and versao == atual.versao:
+            return atual
+        return carregar(conn, versao)
+
+
+class ServicoCubo:
+    # mantém o cubo da carga mais recente; `atual` fica None até a primeira
+    # carga do cubo (e sempre, com o cubo desligado), e a api usa o sql
+
+    def __init__(self, ativo=CUBO_ANALITICO, intervalo=CUBO_INTERVALO, intervalo_maximo=CUBO_INTERVALO_MAXIMO):
+        self.ativo = ativo
+        self.intervalo = intervalo
+        self.intervalo_maximo = intervalo_maximo
+        self.atual = None
+        self._tarefa = None
+
+    async def atualizar(self, engine):
+        # `engine` é síncrona (database.engine_leitura)
+        novo = await asyncio.to_thread(recarregar, engine, self.atual)
+        if novo is not self.atual:
+            # troca o cubo inteiro de uma vez: requisições em andamento
+            # terminam com o anterior
+            self.atual = novo
+            logger.info("cubo analítico carregado (versão %s, %d dias)", novo.versao, novo.n_dias)
+
+    async def _manter(self, engine):
+        falhas = 0
+        while True:
+            try:
+                await self.atualizar(engine)
+                falhas = 0
+            except Exception:
+                falhas += 1
+                logger.exception("falha ao atualizar o cubo analítico (%d seguidas)", falhas)
+            espera = self.intervalo
+            if falhas:
+                espera = max(espera, min(espera * 2 ** (falhas - 1), self.intervalo_maximo))
+            await asyncio.sleep(espera)
+
+    def iniciar(self, engine):
+        if self.ativo and self._tarefa is None:
+            self._tarefa = asyncio.create_task(self._manter(engine))
+
+    async def encerrar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
@@ -0,0 +1,284 @@
+import io
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+import esquema
+
+registro_carga_sql = """
+CREATE TABLE IF NOT EXISTS etl_carga (
+    id              SERIAL PRIMARY KEY,
+    iniciada_em     TIMESTAMP NOT NULL,
+    finalizada_em   TIMESTAMP NOT NULL
+);
+"""
+
+watermark_sql = """
+CREATE TABLE IF NOT EXISTS etl_watermark (
+    origem          TEXT PRIMARY KEY,
+    valor           TEXT,
+    atualizado_em   TIMESTAMP NOT NULL
+);
+"""
+
+
+# hash de cada chave carregada, para gravar só o que mudou entre cargas
+hash_sql = """
+CREATE TABLE IF NOT EXISTS {nome} (
+    tabela          TEXT NOT NULL,
+    chave           BIGINT NOT NULL,
+    hash            BIGINT NOT NULL,
+    PRIMARY KEY (tabela, chave)
+);
+"""
+
+# colunas que não entram no hash: a bridge renumera o id a cada carga
+colunas_fora_do_hash = {"bridge_pedido_produto": {"id"}}
+
+
+def qualificar(tabela, esquema=None):
+    return f"{esquema}.{tabela}" if esquema else tabela
+
+
+def usar_esquema(conn, esquema):
+    # nomes sem esquema passam a apontar para `esquema` até o fim da transação
+    if esquema:
+        conn.execute(text(f"SET LOCAL search_path TO {esquema}"))
+
+
+def _preparar(df, tabela):
+    # ordena as colunas como no ddl e passa as colunas inteiras com nulos para
+    # Int64, para que o csv traga "12" e não "12.0"
+    colunas = esquema.tabelas[tabela]
+    df = df[list(colunas)]
+    inteiros = {
+        coluna: "Int64"
+        for coluna, tipo in colunas.items()
+        if tipo in esquema.TIPOS_INTEIROS and df[coluna].dtype.kind in "fO"
+    }
+    return df.astype(inteiros) if inteiros else df
+
+
+def criar_particoes(df, tabela, conn, nome=None):
+    # cria as partições mensais que o lote vai ocupar, antes do COPY; tabelas
+    # de gerações antigas, sem particionamento, ficam como estão
+    nome = nome or tabela
+    if tabela not in esquema.particionamento:
+        return
+    tipo = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:nome)"), {"nome": nome}
+    ).scalar()
+    if tipo != "p":
+        return
+
+    # um mês já arquivado ganha de novo uma partição aqui (linhas atrasadas ou
+    # carga completa); o próximo arquivamento a junta ao arquivo pela chave
+    conn.execute(text(esquema.ddl_particao(nome)))
+    meses = (df[esquema.particionamento[tabela]].dropna().astype("int64") // 100).unique()
+    for mes in sorted(meses):
+        conn.execute(text(esquema.ddl_particao(nome, int(mes))))
+
+
+def copiar(df, tabela, conn, destino=None):
+    _copiar_csv(_preparar(df, tabela), destino or tabela, conn)
+
+
+def _copiar_csv(df, destino, conn):
+    # envia o dataframe ao postgres com COPY FROM STDIN a partir de um csv em memória
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N")
+    buffer.seek(0)
+
+    colunas = ", ".join(df.columns)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {destino} ({colunas}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def carregar_tabela(df, tabela, engine, esquema_destino=None):
+    # carga completa: recria a tabela com os tipos do esquema e copia o dataframe
+    nome = qualificar(tabela, esquema_destino)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {nome}"))
+        conn.execute(text(esquema.ddl(tabela, nome)))
+        criar_particoes(df, tabela, conn, nome)
+        copiar(df, tabela, conn, destino=nome)
+
+
+def anexar_tabela(df, tabela, engine, esquema_destino=None):
+    if df.empty:
+        return
+
+    nome = qualificar(tabela, esquema_destino)
+    with engine.begin() as conn:
+        conn.execute(text(esquema.ddl(tabela, nome)))
+        criar_particoes(df, tabela, conn, nome)
+        copiar(df, tabela, conn, destino=nome)
+
+
+def _substituir(df, tabela, chave, conn):
+    # delete + insert (em vez de ON CONFLICT): a chave de f_negociacao_atividade,
+    # f_negociacao_item (id_negociacao) e bridge_pedido_produto (id_pedido)
+    # agrupa várias linhas, que o lote traz sempre juntas, e as tabelas
+    # particionadas não têm índice único na chave.
+    lote = f"{tabela}_lote"
+    colunas = ", ".join(esquema.tabelas[tabela])
+    criar_particoes(df, tabela, conn)
+    conn.execute(text(f"CREATE TEMP TABLE {lote} (LIKE {tabela}) ON COMMIT DROP"))
+    copiar(df, tabela, conn, destino=lote)
+    conn.execute(text(
+        f"DELETE FROM {tabela} AS t USING {lote} AS l WHERE t.{chave} = l.{chave}"
+    ))
+    conn.execute(text(
+        f"INSERT INTO {tabela} ({colunas}) SELECT {colunas} FROM {lote}"
+    ))
+
+
+def hashes_por_chave(df, tabela, chave):
+    # hash estável de cada linha transformada (colunas na ordem e nos tipos do
+    # ddl), somado por chave módulo 2^64: não depende da ordem das linhas nem
+    # da largura dos inteiros de cada lote. linhas com a chave nula ficam sem
+    # hash (ver carregar_lote em etl.py)
+    df = _preparar(df[df[chave].notna()], tabela)
+    colunas = [c for c in df.columns if c not in colunas_fora_do_hash.get(tabela, ())]
+    linhas = pd.util.hash_pandas_object(df[colunas], index=False)
+    por_chave = linhas.groupby(df[chave].to_numpy()).sum()
+    return pd.DataFrame({
+        "chave": por_chave.index.to_numpy().astype("int64"),
+        "hash": por_chave.to_numpy().view("int64"),
+    })
+
+
+def anexar_hashes(df, tabela, chave, engine, esquema_destino=None):
+    # carga completa: grava os hashes junto com a nova geração das tabelas
+    hashes = hashes_por_chave(df, tabela, chave)
+    if hashes.empty:
+        return 0
+
+    nome = qualificar("etl_hash", esquema_destino)
+    with engine.begin() as conn:
+        conn.execute(text(hash_sql.format(nome=nome)))
+        hashes.insert(0, "tabela", tabela)
+        _copiar_csv(hashes, nome, conn)
+    return len(hashes)
+
+
+def sincronizar_tabela(df, tabela, chave, engine):
+    # compara os hashes do lote com os guardados e reescreve só as chaves novas
+    # ou alteradas. devolve (novas, alteradas, inalteradas, chaves do lote).
+    hashes = hashes_por_chave(df, tabela, chave)
+    if hashes.empty:
+        return 0, 0, 0, hashes["chave"].to_numpy()
+
+    diferentes = """
+        FROM etl_hash_lote AS l
+        LEFT JOIN etl_hash AS h ON h.tabela = :tabela AND h.chave = l.chave
+        WHERE h.hash IS DISTINCT FROM l.hash
+    """
+    with engine.begin() as conn:
+        conn.execute(text(esquema.ddl(tabela)))
+        conn.execute(text(hash_sql.format(nome="etl_hash")))
+        conn.execute(text("CREATE TEMP TABLE etl_hash_lote (chave BIGINT, hash BIGINT) ON COMMIT DROP"))
+        _copiar_csv(hashes, "etl_hash_lote", conn)
+        mudancas = conn.execute(
+            text(f"SELECT l.chave, h.chave IS NULL {diferentes}"), {"tabela": tabela}
+        ).all()
+
+        if mudancas:
+            alteradas = {chave_lote for chave_lote, _ in mudancas}
+            _substituir(df[df[chave].isin(alteradas)], tabela, chave, conn)
+            conn.execute(
+                text(f"""
+                    INSERT INTO etl_hash (tabela, chave, hash)
+                    SELECT :tabela, l.chave, l.hash {diferentes}
+                    ON CONFLICT (tabela, chave) DO UPDATE SET hash = excluded.hash
+                """),
+                {"tabela": tabela},
+            )
+
+    novas = sum(1 for _, nova in mudancas if nova)
+    return novas, len(mudancas) - novas, len(hashes) - len(mudancas), hashes["chave"].to_numpy()
+
+
+def remover_ausentes(tabela, chave, vistas, engine, sem_chave=None):
+    # carga diferencial: apaga as chaves que não vieram da origem nesta carga e
+    # troca as linhas sem chave (que não têm hash para comparar) pelas desta
+    # carga, `sem_chave`, na mesma transação. devolve quantas chaves foram
+    # removidas, sem contar as linhas sem chave.
+    with engine.begin() as conn:
+        conn.execute(text(esquema.ddl(tabela)))
+        conn.execute(text(hash_sql.format(nome="etl_hash")))
+        conn.execute(text("CREATE TEMP TABLE etl_chaves_vistas (chave BIGINT) ON COMMIT DROP"))
+        _copiar_csv(pd.DataFrame({"chave": vistas}), "etl_chaves_vistas", conn)
+        removidas = conn.execute(text(f"""
+            DELETE FROM {tabela} AS t
+            WHERE NOT EXISTS (SELECT 1 FROM etl_chaves_vistas AS v WHERE v.chave = t.{chave})
+            RETURNING t.{chave}
+        """)).scalars().all()
+        if sem_chave is not None and not sem_chave.empty:
+            criar_particoes(sem_chave, tabela, conn)
+            copiar(sem_chave, tabela, conn)
+        conn.execute(
+            text("""
+                DELETE FROM etl_hash AS h
+                WHERE h.tabela = :tabela
+                  AND NOT EXISTS (SELECT 1 FROM etl_chaves_vistas AS v WHERE v.chave = h.chave)
+            """),
+            {"tabela": tabela},
+        )
+    return len(set(removidas) - {None})
+
+
+def ler_tabela(tabela, colunas, engine, **kwargs):
+    # lê colunas de uma tabela do warehouse (vazia se a tabela ainda não existir)
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(tabela):
+            return pd.DataFrame(columns=colunas)
+        return pd.read_sql(text(f"SELECT {', '.join(colunas)} FROM {tabela}"), conn, **kwargs)
+
+
+def maior_id(tabela, engine, esquema_destino=None):
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(tabela, schema=esquema_destino):
+            return -1
+        return conn.execute(
+            text(f"SELECT coalesce(max(id), -1) FROM {qualificar(tabela, esquema_destino)}")
+        ).scalar()
+
+
+def ler_watermarks(engine):
+    with engine.begin() as conn:
+        conn.execute(text(watermark_sql))
+        linhas = conn.execute(text("SELECT origem, valor FROM etl_watermark")).all()
+    return {origem: valor for origem, valor in linhas}
+
+
+def salvar_watermarks(marcas, engine):
+    with engine.begin() as conn:
+        conn.execute(text(watermark_sql))
+        for origem, valor in marcas.items():
+            conn.execute(
+                text("""
+                    INSERT INTO etl_watermark (origem, valor, atualizado_em)
+                    VALUES (:origem, :valor, :agora)
+                    ON CONFLICT (origem) DO UPDATE
+                    SET valor = excluded.valor, atualizado_em = excluded.atualizado_em
+                """),
+                {"origem": origem, "valor": None if valor is None else str(valor), "agora": datetime.now()},
+            )
+
+
+def registrar_carga(inicio, engine):
+    # a api usa o id mais recente como versão do warehouse
+    with engine.begin() as conn:
+        conn.execute(text(registro_carga_sql))
+        conn.execute(
+            text("INSERT INTO etl_carga (iniciada_em, finalizada_em) VALUES (:inicio, :fim)"),
+            {"inicio": inicio, "fim": datetime.now()},
+        )
@@ -0,0 +1,273 @@
+from datetime import date, timedelta
+
+from sqlalchemy import inspect, text
+
+# definição das tabelas do warehouse: coluna -> tipo no postgres.
+# a carga cria as tabelas a partir daqui em vez de deixar o pandas inferir os tipos.
+tabelas = {
+    "d_cliente": {
+        "id": "BIGINT",
+        "nome": "TEXT",
+        "tipo_pessoa": "TEXT",
+        "tipo_cliente": "TEXT",
+        "email": "TEXT",
+        "fone": "TEXT",
+        "sexo": "TEXT",
+        "categoria": "TEXT",
+        "data_nascimento": "DATE",
+    },
+    "d_produto": {
+        "id": "BIGINT",
+        "nome": "TEXT",
+        "familia_produto": "TEXT",
+    },
+    "d_vendedor": {
+        "id": "BIGINT",
+        "nome": "TEXT",
+        "email": "TEXT",
+        "fone": "TEXT",
+        "tipo": "TEXT",
+        "categoria": "TEXT",
+        "data_nasc": "DATE",
+    },
+    "d_calendario": {
+        "id": "INTEGER",
+        "data": "DATE",
+        "ano": "INTEGER",
+        "mes": "INTEGER",
+        "dia": "INTEGER",
+        "nome_mes": "TEXT",
+        "semana": "INTEGER",
+        "trimestre": "INTEGER",
+    },
+    "f_pedido_item": {
+        "id": "BIGINT",
+        "data_pedido": "TIMESTAMP",
+        "id_cliente": "BIGINT",
+        "id_vendedor": "BIGINT",
+        "id_produto": "BIGINT",
+        "id_condicao_pagamento": "BIGINT",
+        "quantidade_pedida": "DOUBLE PRECISION",
+        "tipo_pedido": "TEXT",
+        "id_calendario": "INTEGER",
+        "valor_produto": "DOUBLE PRECISION",
+        "valor_total_pedido": "DOUBLE PRECISION",
+    },
+    "f_conta": {
+        "id": "BIGINT",
+        "id_pessoa": "BIGINT",
+        "id_pedido_venda": "BIGINT",
+        "categoria_conta": "TEXT",
+        "forma_pagamento": "TEXT",
+        "gateway_pagamento": "TEXT",
+        "tipo_conta": "TEXT",
+        "id_calendario_pagamento": "INTEGER",
+        "id_calendario_vencimento": "INTEGER",
+        "id_calendario_emissao": "INTEGER",
+        "despesa": "TEXT",
+        "parcela": "DOUBLE PRECISION",
+        "valor": "DOUBLE PRECISION",
+    },
+    "f_negociacao": {
+        "id": "BIGINT",
+        "id_cliente": "BIGINT",
+        "id_vendedor": "BIGINT",
+        "etapa_negociacao": "TEXT",
+        "origem_contato": "TEXT",
+        "id_calendario_inicio": "INTEGER",
+        "id_calendario_fechamento": "INTEGER",
+        "id_calendario_fechamento_esperada": "INTEGER",
+    },
+    "f_negociacao_atividade": {
+        "id": "BIGINT",
+        "id_negociacao": "BIGINT",
+        "atividade_negociacao": "TEXT",
+        "tipo_atividade": "TEXT",
+        "horario_inicial": "TIMESTAMP",
+        "horario_final": "TIMESTAMP",
+        "id_horario_inicial": "INTEGER",
+        "id_horario_final": "INTEGER",
+    },
+    "f_negociacao_item": {
+        "id": "BIGINT",
+        "id_negociacao": "BIGINT",
+        "id_produto": "BIGINT",
+        "quantidade_produto": "DOUBLE PRECISION",
+        "valor_produto": "DOUBLE PRECISION",
+    },
+    "bridge_pedido_produto": {
+        "id": "BIGINT",
+        "id_pedido": "BIGINT",
+        "id_produto": "BIGINT",
+    },
+}
+
+TIPOS_INTEIROS = {"SMALLINT", "INTEGER", "BIGINT"}
+
+# tabelas fato particionadas por mês (range) na chave de calendário que as
+# consultas filtram; o postgres descarta as partições fora do intervalo.
+# cada mês vira a partição <tabela>_paaaamm e as chaves nulas vão para
+# <tabela>_padrao.
+particionamento = {
+    "f_conta": "id_calendario_vencimento",
+    "f_negociacao": "id_calendario_inicio",
+}
+
+# chave de cada tabela do warehouse: a das cargas incremental e diferencial e a
+# que decide, no arquivo, qual versão de uma linha vale
+chaves = {
+    "d_cliente": "id",
+    "d_produto": "id",
+    "d_vendedor": "id",
+    "f_pedido_item": "id",
+    "f_conta": "id",
+    "f_negociacao": "id",
+    "f_negociacao_atividade": "id_negociacao",
+    "f_negociacao_item": "id_negociacao",
+    "bridge_pedido_produto": "id_pedido",
+}
+
+
+def ddl(tabela, nome=None):
+    nome = nome or tabela
+    colunas = ",\n    ".join(f"{coluna} {tipo}" for coluna, tipo in tabelas[tabela].items())
+    sql = f"CREATE TABLE IF NOT EXISTS {nome} (\n    {colunas}\n)"
+    if tabela in particionamento:
+        sql += f" PARTITION BY RANGE ({particionamento[tabela]})"
+    return sql
+
+
+def limites_particao(mes):
+    # mes no formato aaaamm; as chaves aaaammdd do mês ficam em [aaaamm00, próximo aaaamm00)
+    ano, m = divmod(mes, 100)
+    proximo = (ano + 1) * 100 + 1 if m == 12 else mes + 1
+    return f"FOR VALUES FROM ({mes * 100}) TO ({proximo * 100})"
+
+
+def ddl_particao(nome, mes=None):
+    if mes is None:
+        return f"CREATE TABLE IF NOT EXISTS {nome}_padrao PARTITION OF {nome} DEFAULT"
+    return f"CREATE TABLE IF NOT EXISTS {nome}_p{mes} PARTITION OF {nome} {limites_particao(mes)}"
+
+
+# índices usados pelos endpoints analíticos da api e pelo upsert incremental.
+# os das tabelas fato cobrem as colunas lidas pelas consultas (INCLUDE), para
+# que o postgres responda com index-only scan no intervalo de datas.
+indices = {
+    "d_calendario": [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_d_calendario_id ON d_calendario (id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_d_calendario_data ON d_calendario (data)",
+    ],
+    "f_negociacao": [
+        # índice único em tabela particionada precisaria incluir a chave da partição
+        "CREATE INDEX IF NOT EXISTS ix_f_negociacao_id ON f_negociacao (id)",
+        """CREATE INDEX IF NOT EXISTS ix_f_negociacao_inicio ON f_negociacao (id_calendario_inicio)
+           INCLUDE (id, id_cliente, etapa_negociacao, origem_contato)""",
+        """CREATE INDEX IF NOT EXISTS ix_f_negociacao_origem_inicio
+           ON f_negociacao (origem_contato, id_calendario_inicio)""",
+    ],
+    "f_negociacao_atividade": [
+        """CREATE INDEX IF NOT EXISTS ix_f_negociacao_atividade_negociacao
+           ON f_negociacao_atividade (id_negociacao)""",
+    ],
+    "f_negociacao_item": [
+        "CREATE INDEX IF NOT EXISTS ix_f_negociacao_item_negociacao ON f_negociacao_item (id_negociacao)",
+    ],
+    "f_conta": [
+        "CREATE INDEX IF NOT EXISTS ix_f_conta_id ON f_conta (id)",
+        """CREATE INDEX IF NOT EXISTS ix_f_conta_vencimento ON f_conta (id_calendario_vencimento)
+           INCLUDE (valor, id_calendario_pagamento)""",
+    ],
+    "f_pedido_item": [
+        "CREATE INDEX IF NOT EXISTS ix_f_pedido_item_id ON f_pedido_item (id)",
+    ],
+    "bridge_pedido_produto": [
+        "CREATE INDEX IF NOT EXISTS ix_bridge_pedido_produto_pedido ON bridge_pedido_produto (id_pedido)",
+    ],
+    "d_cliente": ["CREATE INDEX IF NOT EXISTS ix_d_cliente_id ON d_cliente (id)"],
+    "d_produto": ["CREATE INDEX IF NOT EXISTS ix_d_produto_id ON d_produto (id)"],
+    "d_vendedor": ["CREATE INDEX IF NOT EXISTS ix_d_vendedor_id ON d_vendedor (id)"],
+    "r_negociacao_mensal": [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_r_negociacao_mensal ON r_negociacao_mensal (ano, mes)",
+    ],
+    "r_negociacao_origem_mensal": [
+        """CREATE UNIQUE INDEX IF NOT EXISTS ux_r_negociacao_origem_mensal
+           ON r_negociacao_origem_mensal (ano, mes, origem_contato)""",
+    ],
+    "r_conta_mensal": [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_r_conta_mensal ON r_conta_mensal (ano, mes)",
+    ],
+}
+
+# consultas equivalentes às dos endpoints (modo tempo_real), usadas para
+# conferir com EXPLAIN se o planejador está usando os índices acima
+verificacoes = {
+    "/origem-leads": """
+        SELECT origem_contato, count(id)
+        FROM f_negociacao
+        WHERE id_calendario_inicio BETWEEN :inicio AND :fim
+        GROUP BY origem_contato
+    """,
+    "/matricula-lead, /taxa-conversao": """
+        SELECT id_calendario_inicio / 100,
+               count(DISTINCT id_cliente),
+               count(id) FILTER (WHERE etapa_negociacao LIKE 'NEGOCIA%'
+                                    OR etapa_negociacao = 'MATRICULADO')
+        FROM f_negociacao
+        WHERE id_calendario_inicio >= :inicio
+        GROUP BY 1
+    """,
+    "/inadimplencia": """
+        SELECT id_calendario_vencimento / 100,
+               sum(valor),
+               sum(CASE WHEN id_calendario_pagamento IS NOT NULL THEN valor ELSE 0 END),
+               sum(CASE WHEN id_calendario_pagamento IS NULL THEN valor ELSE 0 END)
+        FROM f_conta
+        WHERE id_calendario_vencimento >= :inicio
+        GROUP BY 1
+    """,
+}
+
+
+def _indices_do_plano(no):
+    encontrados = {no["Index Name"]} if "Index Name" in no else set()
+    for filho in no.get("Plans", []):
+        encontrados |= _indices_do_plano(filho)
+    return encontrados
+
+
+def provisionar(engine, meses=6, esquema=None):
+    # cria os índices que faltam, atualiza as estatísticas e confere os planos.
+    # devolve {endpoint: índices usados}; um conjunto vazio indica seq scan.
+    prefixo = f"{esquema}." if esquema else ""
+    with engine.begin() as conn:
+        if esquema:
+            conn.execute(text(f"SET LOCAL search_path TO {esquema}"))
+        existentes = set(inspect(conn).get_table_names(schema=esquema))
+        for tabela, comandos in indices.items():
+            if tabela not in existentes:
+                continue
+            for comando in comandos:
+                conn.execute(text(comando))
+
+    # ANALYZE fora da transação da criação dos índices
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for tabela in indices:
+            if tabela in existentes:
+                conn.execute(text(f"ANALYZE {prefixo}{tabela}"))
+
+    hoje = date.today()
+    inicio = hoje.replace(day=1) - timedelta(days=30 * meses)
+    params = {
+        "inicio": inicio.year * 10000 + inicio.month * 100 + inicio.day,
+        "fim": hoje.year * 10000 + hoje.month * 100 + hoje.day,
+    }
+
+    planos = {}
+    with engine.begin() as conn:
+        if esquema:
+            conn.execute(text(f"SET LOCAL search_path TO {esquema}"))
+        for endpoint, query in verificacoes.items():
+            plano = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params).scalar()
+            planos[endpoint] = _indices_do_plano(plano[0]["Plan"])
+    return planos
@@ -0,0 +1,226 @@
+import time
+from datetime import date
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+import esquema
+
+# carga blue-green: a carga completa escreve em ESQUEMA_STAGING (tabelas,
+# agregações e índices) enquanto a api continua lendo ESQUEMA_ATUAL. no fim,
+# uma transação curta move as tabelas do staging para o esquema atual e as
+# atuais para ESQUEMA_ANTERIOR, de onde podem voltar com reverter().
+ESQUEMA_ATUAL = "public"
+ESQUEMA_STAGING = "etl_staging"
+ESQUEMA_ANTERIOR = "etl_anterior"
+ESQUEMA_TROCA = "etl_troca"
+# partições antigas desanexadas das tabelas fato
+ESQUEMA_ARQUIVO = "etl_arquivo"
+
+# a troca precisa de lock exclusivo nas tabelas; em vez de enfileirar atrás de
+# uma consulta longa (e travar as novas), desiste e tenta de novo
+ESPERA_LOCK = "5s"
+TENTATIVAS = 5
+
+
+def preparar_staging(engine):
+    # descarta o que sobrou de uma carga interrompida
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA_STAGING} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {ESQUEMA_STAGING}"))
+
+
+def _tabelas(conn, nome_esquema):
+    # tabelas do esquema, sem as partições (que andam junto com a tabela mãe)
+    return conn.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :esquema AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+        """),
+        {"esquema": nome_esquema},
+    ).scalars().all()
+
+
+def _particoes(conn, nome):
+    return conn.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:nome)
+            ORDER BY c.relname
+        """),
+        {"nome": nome},
+    ).scalars().all()
+
+
+def _mover(conn, tabelas, origem, destino):
+    # SET SCHEMA na tabela mãe não leva as partições; elas são movidas uma a uma
+    for tabela in tabelas:
+        particoes = _particoes(conn, f"{origem}.{tabela}")
+        conn.execute(text(f"ALTER TABLE {origem}.{tabela} SET SCHEMA {destino}"))
+        for particao in particoes:
+            conn.execute(text(f"ALTER TABLE {origem}.{particao} SET SCHEMA {destino}"))
+
+
+def em_transacao_curta(engine, trocar):
+    for tentativa in range(1, TENTATIVAS + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{ESPERA_LOCK}'"))
+                return trocar(conn)
+        except OperationalError as exc:
+            # 55P03: lock_not_available
+            if getattr(exc.orig, "pgcode", None) != "55P03" or tentativa == TENTATIVAS:
+                raise
+            print(f"tabelas ocupadas, nova tentativa de troca ({tentativa}/{TENTATIVAS})...")
+            time.sleep(tentativa)
+
+
+def publicar(engine):
+    # staging -> atual -> anterior; devolve as tabelas publicadas
+    def trocar(conn):
+        novas = _tabelas(conn, ESQUEMA_STAGING)
+        atuais = set(_tabelas(conn, ESQUEMA_ATUAL))
+
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {ESQUEMA_ANTERIOR} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {ESQUEMA_ANTERIOR}"))
+        _mover(conn, [t for t in novas if t in atuais], ESQUEMA_ATUAL, ESQUEMA_ANTERIOR)
+        _mover(conn, novas, ESQUEMA_STAGING, ESQUEMA_ATUAL)
+        conn.execute(text(f"DROP SCHEMA {ESQUEMA_STAGING}"))
+        return novas
+
+    return em_transacao_curta(engine, trocar)
+
+
+def reverter(engine):
+    # troca a geração atual pela anterior (chamar de novo desfaz a reversão)
+    def trocar(conn):
+        if not inspect(conn).has_schema(ESQUEMA_ANTERIOR):
+            raise RuntimeError("não há geração anterior para restaurar")
+        anteriores = _tabelas(conn, ESQUEMA_ANTERIOR)
+        atuais = set(_tabelas(conn, ESQUEMA_ATUAL))
+
+        conn.execute(text(f"CREATE SCHEMA {ESQUEMA_TROCA}"))
+        _mover(conn, [t for t in anteriores if t in atuais], ESQUEMA_ATUAL, ESQUEMA_TROCA)
+        _mover(conn, anteriores, ESQUEMA_ANTERIOR, ESQUEMA_ATUAL)
+        _mover(conn, _tabelas(conn, ESQUEMA_TROCA), ESQUEMA_TROCA, ESQUEMA_ANTERIOR)
+        conn.execute(text(f"DROP SCHEMA {ESQUEMA_TROCA}"))
+        return anteriores
+
+    return em_transacao_curta(engine, trocar)
+
+
+def _soltas(conn, nome_esquema, padrao):
+    # tabelas comuns do esquema, fora de qualquer tabela particionada
+    return conn.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :esquema AND c.relkind = 'r' AND NOT c.relispartition
+              AND c.relname LIKE :padrao
+            ORDER BY c.relname
+        """),
+        {"esquema": nome_esquema, "padrao": padrao},
+    ).scalars().all()
+
+
+def _mes(particao):
+    # f_conta_p202401 -> ("f_conta", 202401); None para a partição padrão
+    tabela, _, sufixo = particao.rpartition("_p")
+    if not sufixo.isdigit():
+        return None
+    return tabela, int(sufixo)
+
+
+def _arquivo(conn, tabela):
+    # o arquivo de cada tabela fato é uma tabela particionada em ESQUEMA_ARQUIVO
+    # com os meses arquivados como partições. meses arquivados por versões
+    # anteriores, soltos no esquema, são anexados a ela na primeira vez.
+    nome = f"{ESQUEMA_ARQUIVO}.{tabela}"
+    if conn.execute(text("SELECT to_regclass(:nome)"), {"nome": nome}).scalar() is not None:
+        return nome
+    chave = esquema.chaves[tabela]
+    conn.execute(text(esquema.ddl(tabela, nome)))
+    conn.execute(text(f"CREATE INDEX ix_{tabela}_{chave} ON {nome} ({chave})"))
+    for particao in _soltas(conn, ESQUEMA_ARQUIVO, f"{tabela}\\_p%"):
+        tabela_mes = _mes(particao)
+        if tabela_mes is not None and tabela_mes[0] == tabela:
+            conn.execute(text(
+                f"ALTER TABLE {nome} ATTACH PARTITION {ESQUEMA_ARQUIVO}.{particao} "
+                f"{esquema.limites_particao(tabela_mes[1])}"
+            ))
+    return nome
+
+
+def _incorporar(conn, entrada):
+    # junta ao arquivo um mês desanexado (<particao>_entrada). a versão que
+    # chega de cada chave substitui a arquivada, em qualquer mês; se o mês já
+    # estava arquivado (recriado por uma carga completa ou por linhas
+    # atrasadas de uma incremental), as linhas se somam às que ficaram nele.
+    particao = entrada.removesuffix("_entrada")
+    tabela, mes = _mes(particao)
+    arquivo = _arquivo(conn, tabela)
+    chave = esquema.chaves[tabela]
+    colunas = ", ".join(esquema.tabelas[tabela])
+    origem = f"{ESQUEMA_ARQUIVO}.{entrada}"
+
+    conn.execute(text(f"DELETE FROM {arquivo} AS a USING {origem} AS e WHERE a.{chave} = e.{chave}"))
+    if particao in _particoes(conn, arquivo):
+        conn.execute(text(f"INSERT INTO {arquivo} ({colunas}) SELECT {colunas} FROM {origem}"))
+        conn.execute(text(f"DROP TABLE {origem}"))
+    else:
+        conn.execute(text(f"ALTER TABLE {origem} RENAME TO {particao}"))
+        conn.execute(text(
+            f"ALTER TABLE {arquivo} ATTACH PARTITION {ESQUEMA_ARQUIVO}.{particao} "
+            f"{esquema.limites_particao(mes)}"
+        ))
+
+
+def incorporar_pendentes(engine):
+    # termina um arquivamento interrompido entre a troca e a incorporação,
+    # para que as agregações voltem a ver esses meses
+    with engine.connect() as conn:
+        if not inspect(conn).has_schema(ESQUEMA_ARQUIVO):
+            return []
+        entradas = _soltas(conn, ESQUEMA_ARQUIVO, "%\\_entrada")
+    for entrada in entradas:
+        with engine.begin() as conn:
+            _incorporar(conn, entrada)
+    return [entrada.removesuffix("_entrada") for entrada in entradas]
+
+
+def arquivar_particoes(engine, meses):
+    # desanexa das tabelas fato atuais as partições mensais anteriores aos
+    # últimos `meses` meses e as incorpora ao arquivo (ESQUEMA_ARQUIVO). a
+    # troca é uma transação curta e só de metadado; a incorporação roda depois,
+    # sem lock nas tabelas atuais. nada do que já está arquivado é descartado:
+    # a fonte pode ter expurgado esses meses, e o arquivo é a única cópia. as
+    # agregações mensais leem as tabelas atuais e o arquivo (ver rollups.py).
+    hoje = date.today()
+    ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - meses, 12)
+    limite = ano * 100 + mes + 1
+
+    def desanexar(conn):
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ESQUEMA_ARQUIVO}"))
+        arquivadas = []
+        for tabela in esquema.particionamento:
+            for particao in _particoes(conn, f"{ESQUEMA_ATUAL}.{tabela}"):
+                tabela_mes = _mes(particao)
+                if tabela_mes is None or tabela_mes[1] >= limite:
+                    continue
+                conn.execute(text(
+                    f"ALTER TABLE {ESQUEMA_ATUAL}.{tabela} DETACH PARTITION {ESQUEMA_ATUAL}.{particao}"
+                ))
+                # renomeada antes de mudar de esquema: o mês pode já estar arquivado
+                conn.execute(text(f"ALTER TABLE {ESQUEMA_ATUAL}.{particao} RENAME TO {particao}_entrada"))
+                conn.execute(text(f"ALTER TABLE {ESQUEMA_ATUAL}.{particao}_entrada SET SCHEMA {ESQUEMA_ARQUIVO}"))
+                arquivadas.append(particao)
+        return arquivadas
+
+    arquivadas = em_transacao_curta(engine, desanexar)
+    incorporar_pendentes(engine)
+    return arquivadas
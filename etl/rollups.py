@@ -0,0 +1,110 @@
+from sqlalchemy import inspect, text
+
+import esquema
+from carga import usar_esquema
+from publicacao import ESQUEMA_ARQUIVO, em_transacao_curta
+
+# agregações mensais consumidas pelos endpoints analíticos da api. {f_negociacao}
+# e {f_conta} são as tabelas fato com o histórico arquivado (ver _fonte)
+rollup_queries = {
+    "r_negociacao_mensal": """
+SELECT
+    c.ano                                   AS ano,
+    c.mes                                   AS mes,
+    c.nome_mes                              AS nome_mes,
+    count(n.id)                             AS total_negociacoes,
+    count(DISTINCT n.id_cliente)            AS total_clientes,
+    count(n.id) FILTER (
+        WHERE n.etapa_negociacao LIKE 'NEGOCIA%'
+           OR n.etapa_negociacao = 'MATRICULADO'
+    )                                       AS total_matriculas
+FROM {f_negociacao} AS n
+JOIN d_calendario AS c
+    ON c.id = n.id_calendario_inicio
+GROUP BY c.ano, c.mes, c.nome_mes
+""",
+    "r_negociacao_origem_mensal": """
+SELECT
+    c.ano                                                AS ano,
+    c.mes                                                AS mes,
+    c.nome_mes                                           AS nome_mes,
+    coalesce(n.origem_contato, 'Não especificado')       AS origem_contato,
+    count(n.id)                                          AS total_negociacoes,
+    count(DISTINCT n.id_cliente)                         AS total_clientes,
+    count(n.id) FILTER (
+        WHERE n.etapa_negociacao LIKE 'NEGOCIA%'
+           OR n.etapa_negociacao = 'MATRICULADO'
+    )                                                    AS total_matriculas
+FROM {f_negociacao} AS n
+JOIN d_calendario AS c
+    ON c.id = n.id_calendario_inicio
+GROUP BY c.ano, c.mes, c.nome_mes, coalesce(n.origem_contato, 'Não especificado')
+""",
+    "r_conta_mensal": """
+SELECT
+    c.ano                                                            AS ano,
+    c.mes                                                            AS mes,
+    c.nome_mes                                                       AS nome_mes,
+    sum(co.valor)                                                    AS valor_total,
+    sum(CASE WHEN co.id_calendario_pagamento IS NOT NULL
+             THEN co.valor ELSE 0 END)                               AS receita_total,
+    sum(CASE WHEN co.id_calendario_pagamento IS NULL
+             THEN co.valor ELSE 0 END)                               AS valor_inadimplente
+FROM {f_conta} AS co
+JOIN d_calendario AS c
+    ON c.id = co.id_calendario_vencimento
+GROUP BY c.ano, c.mes, c.nome_mes
+""",
+}
+
+
+def _fonte(conn, tabela):
+    # as partições arquivadas (publicacao.arquivar_particoes) saíram das tabelas
+    # fato mas continuam nas agregações: as linhas do arquivo entram quando a
+    # chave não está nas tabelas atuais, que têm a versão mais nova
+    if conn.dialect.name != "postgresql" or not inspect(conn).has_table(tabela, schema=ESQUEMA_ARQUIVO):
+        return tabela
+    colunas = ", ".join(esquema.tabelas[tabela])
+    chave = esquema.chaves[tabela]
+    return f"""(
+    SELECT {colunas} FROM {tabela}
+    UNION ALL
+    SELECT {colunas} FROM {ESQUEMA_ARQUIVO}.{tabela} AS a
+    WHERE NOT EXISTS (SELECT 1 FROM {tabela} AS t WHERE t.{chave} = a.{chave})
+)"""
+
+
+def _consultas(conn):
+    fontes = {tabela: _fonte(conn, tabela) for tabela in esquema.particionamento}
+    return {tabela: query.format(**fontes) for tabela, query in rollup_queries.items()}
+
+
+def construir_rollups(engine, esquema_destino=None):
+    # recria as agregações a partir das tabelas fato já carregadas. na carga
+    # completa (`esquema_destino` = staging) e nos bancos sem leitores concorrentes
+    # (o sqlite do gerador), recria no lugar. na incremental e na diferencial
+    # a api está lendo as agregações atuais: cada uma é montada em
+    # <tabela>_nova, com os índices, e entra no lugar da atual numa transação
+    # curta, como na publicação da carga completa.
+    if esquema_destino is not None or engine.dialect.name != "postgresql":
+        with engine.begin() as conn:
+            usar_esquema(conn, esquema_destino)
+            for tabela, query in _consultas(conn).items():
+                conn.execute(text(f"DROP TABLE IF EXISTS {tabela}"))
+                conn.execute(text(f"CREATE TABLE {tabela} AS {query}"))
+        return
+
+    with engine.begin() as conn:
+        for tabela, query in _consultas(conn).items():
+            conn.execute(text(f"DROP TABLE IF EXISTS {tabela}_nova"))
+            conn.execute(text(f"CREATE TABLE {tabela}_nova AS {query}"))
+
+    def trocar(conn):
+        for tabela in rollup_queries:
+            conn.execute(text(f"DROP TABLE IF EXISTS {tabela}"))
+            conn.execute(text(f"ALTER TABLE {tabela}_nova RENAME TO {tabela}"))
+            # tabelas de poucas linhas: os índices saem em milissegundos
+            for comando in esquema.indices.get(tabela, []):
+                conn.execute(text(comando))
+
+    em_transacao_curta(engine, trocar)
@@ -0,0 +1,193 @@
+import os
+import threading
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from sqlalchemy import select, text
+from sqlalchemy.types import Date, DateTime, Double, Float, Integer
+
+from . import models
+
+# exportação colunar (arrow ipc ou parquet) para o power bi. as linhas saem do
+# banco em lotes e viram record batches sem passar por dicts nem pelo pydantic.
+
+EXPORT_TAMANHO_LOTE = int(os.getenv("EXPORT_TAMANHO_LOTE", "65536"))
+# exportar a tabela inteira passa do DB_STATEMENT_TIMEOUT_MS das consultas; 0 desliga
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "0"))
+
+# tabela exportável -> (modelo, coluna de data usada nos filtros)
+TABELAS = {
+    "f_conta": (models.Conta, "id_calendario_vencimento"),
+    "f_negociacao": (models.Negociacao, "id_calendario_inicio"),
+}
+
+FORMATOS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ColunaInvalida(ValueError):
+    pass
+
+
+def _tipo_arrow(tipo):
+    if isinstance(tipo, DateTime):
+        return pa.timestamp("us")
+    if isinstance(tipo, Date):
+        return pa.date32()
+    if isinstance(tipo, Integer):
+        return pa.int64()
+    if isinstance(tipo, (Double, Float)):
+        return pa.float64()
+    return pa.string()
+
+
+def _chave_data(d):
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def consulta(tabela, colunas=None, data_inicio=None, data_fim=None):
+    # select com as colunas pedidas e o filtro de datas, mais o schema arrow equivalente
+    modelo, coluna_data = TABELAS[tabela]
+    disponiveis = modelo.__table__.columns
+    nomes = colunas or [c.name for c in disponiveis]
+    desconhecidas = [nome for nome in nomes if nome not in disponiveis]
+    if desconhecidas:
+        raise ColunaInvalida(f"colunas inexistentes em {tabela}: {', '.join(desconhecidas)}")
+
+    selecionadas = [disponiveis[nome] for nome in nomes]
+    stmt = select(*selecionadas)
+    if data_inicio is not None:
+        stmt = stmt.where(disponiveis[coluna_data] >= _chave_data(data_inicio))
+    if data_fim is not None:
+        stmt = stmt.where(disponiveis[coluna_data] <= _chave_data(data_fim))
+
+    schema = pa.schema([(c.name, _tipo_arrow(c.type)) for c in selecionadas])
+    return stmt, schema
+
+
+def _lotes_copy(conn, stmt, schema):
+    # postgres: COPY ... TO STDOUT num pipe lido pelo parser csv do arrow, que
+    # monta as colunas direto dos bytes
+    sql = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    leitura, escrita = os.pipe()
+    erro = []
+
+    def copiar():
+        cursor = conn.connection.cursor()
+        try:
+            with open(escrita, "wb") as saida:
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, NULL '\\N')", saida)
+        except Exception as exc:
+            erro.append(exc)
+        finally:
+            cursor.close()
+
+    thread = threading.Thread(target=copiar, daemon=True)
+    thread.start()
+    entrada = open(leitura, "rb")
+    leitor = None
+    try:
+        leitor = pa_csv.open_csv(
+            entrada,
+            read_options=pa_csv.ReadOptions(
+                column_names=schema.names, block_size=1 << 22, use_threads=False
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=schema, null_values=["\\N"], strings_can_be_null=True
+            ),
+        )
+        for lote in leitor:
+            yield lote
+    finally:
+        # fechar a leitura antes do join destrava o COPY se o cliente desistiu no meio
+        if leitor is not None:
+            leitor.close()
+        entrada.close()
+        thread.join()
+    if erro:
+        raise erro[0]
+
+
+def _lotes_cursor(conn, stmt, schema, tamanho_lote):
+    # demais bancos: cursor no servidor, lido em partições e transposto em colunas
+    resultado = conn.execution_options(stream_results=True, yield_per=tamanho_lote).execute(stmt)
+    for linhas in resultado.partitions():
+        colunas = zip(*linhas)
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(valores, type=campo.type) for valores, campo in zip(colunas, schema)],
+            schema=schema,
+        )
+
+
+def lotes(engine, stmt, schema, tamanho_lote=EXPORT_TAMANHO_LOTE):
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(f"SET LOCAL statement_timeout = {EXPORT_STATEMENT_TIMEOUT_MS}"))
+            yield from _lotes_copy(conn, stmt, schema)
+        else:
+            yield from _lotes_cursor(conn, stmt, schema, tamanho_lote)
+
+
+class _Saida:
+    # destino em memória que o writer do arrow preenche e o stream esvazia a cada lote
+    closed = False
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+
+    def write(self, dados):
+        dados = bytes(dados)
+        self._partes.append(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drenar(self):
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def serializar(lotes_arrow, schema, formato):
+    # gera os bytes do arquivo conforme os lotes chegam
+    saida = _Saida()
+    if formato == "parquet":
+        writer = pq.ParquetWriter(saida, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(saida, schema)
+
+    try:
+        for lote in lotes_arrow:
+            if formato == "parquet":
+                writer.write_batch(lote, row_group_size=lote.num_rows)
+            else:
+                writer.write_batch(lote)
+            dados = saida.drenar()
+            if dados:
+                yield dados
+    finally:
+        writer.close()
+    yield saida.drenar()
+
+
+def tabela_de_linhas(linhas, modelo_resposta):
+    # resultados analíticos (poucas linhas por mês) com o schema do modelo de resposta
+    tipos = {int: pa.int64(), float: pa.float64(), str: pa.string(), date: pa.date32()}
+    schema = pa.schema([
+        (nome, tipos.get(campo.annotation, pa.string()))
+        for nome, campo in modelo_resposta.model_fields.items()
+    ])
+    return pa.Table.from_pylist(linhas, schema=schema)
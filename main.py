@@ -1,19 +1,67 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
-from sqlalchemy.orm import Session
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from jose import JWTError, jwt
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from datetime import datetime, timedelta, timezone, date
-from sqlalchemy import func, case, or_
 
-from . import database, models, schemas
+from . import cache, consultas, cubo, database, exportacao, metricas, models, schemas, senhas
 
 SECRET_KEY = "chave_secreta"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+servico_senhas = senhas.ServicoSenhas()
+servico_cubo = cubo.ServicoCubo()
+
+# tabelas mantidas pela api; as demais são do warehouse e o etl as cria
+TABELAS_APLICACAO = [models.Usuario.__table__]
+# espera máxima pela verificação do esquema na subida, em segundos
+ESPERA_ESQUEMA = 15
+
+
+async def verificar_esquema():
+    # cria as tabelas da api no primário e avisa das tabelas do warehouse que
+    # ainda não existem na leitura
+    async with database.async_engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all, tables=TABELAS_APLICACAO)
+
+    async with database.async_engine_leitura.connect() as conn:
+        existentes = set(await conn.run_sync(lambda c: inspect(c).get_table_names()))
+    faltando = sorted(
+        tabela for tabela in models.Base.metadata.tables
+        if tabela not in existentes and tabela not in {t.name for t in TABELAS_APLICACAO}
+    )
+    if faltando:
+        logger.warning("tabelas do warehouse ausentes (rode o etl): %s", ", ".join(faltando))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # um banco lento ou fora do ar não impede a subida: os pools reconectam
+    # (pre-ping) quando ele voltar, e as requisições falham até lá
+    try:
+        await asyncio.wait_for(verificar_esquema(), ESPERA_ESQUEMA)
+    except Exception:
+        logger.exception("não foi possível verificar o esquema do banco na subida")
+    servico_cubo.iniciar(database.engine_leitura)
+    yield
+    await servico_cubo.encerrar()
+    servico_senhas.encerrar()
+    await database.async_engine.dispose()
+    await database.async_engine_leitura.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,17 +71,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-models.Base.metadata.create_all(bind=database.engine)
+app.middleware("http")(metricas.medir_requisicao)
 
-pwd_hasher = PasswordHasher()
+cache_respostas = cache.CacheRespostas()
 
 
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_db_leitura():
+    # endpoints só de leitura: vão para a réplica quando ela está configurada
+    async with database.AsyncSessionLeitura() as db:
         yield db
-    finally:
-        db.close()
 
 
 def criar_token(dados: dict):
@@ -42,271 +93,316 @@ def criar_token(dados: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+
+async def trabalho_senha(operacao, *args):
+    # o pool de senhas recusa quando a fila está cheia, para que um pico de
+    # logins não prenda as demais requisições esperando
+    try:
+        return await operacao(*args)
+    except senhas.FilaCheia:
+        raise HTTPException(
+            status_code=503,
+            detail="Muitas autenticações simultâneas, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+    except senhas.PoolIndisponivel:
+        raise HTTPException(
+            status_code=503,
+            detail="Serviço de autenticação reiniciando, tente novamente",
+            headers={"Retry-After": "1"},
+        )
+
 @app.post("/register", response_model=schemas.UsuarioResponse)
-def register(user: schemas.UsuarioCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UsuarioCreate, db: AsyncSession = Depends(get_db)):
     user_existence = (
-        db.query(models.Usuario).filter(models.Usuario.email == user.email).first()
-    )
+        await db.execute(select(models.Usuario).filter(models.Usuario.email == user.email))
+    ).scalars().first()
     if user_existence:
         raise HTTPException(status_code=400, detail="Email já cadastrado")
 
-    senha_hash = pwd_hasher.hash(user.senha)
+    senha_hash = await trabalho_senha(servico_senhas.gerar_hash, user.senha)
     
     novo_user = models.Usuario(nome=user.nome, email=user.email, senha_hash=senha_hash)
     db.add(novo_user)
-    db.commit()
-    db.refresh(novo_user)
+    await db.commit()
+    await db.refresh(novo_user)
     return novo_user
 
 
 @app.post("/login", response_model=schemas.TokenResponse)
-def login(user: schemas.UsuarioLogin, db: Session = Depends(get_db)):
+async def login(user: schemas.UsuarioLogin, db: AsyncSession = Depends(get_db)):
     usuario = (
-        db.query(models.Usuario).filter(models.Usuario.email == user.email).first()
-    )
+        await db.execute(select(models.Usuario).filter(models.Usuario.email == user.email))
+    ).scalars().first()
     if not usuario:
         raise HTTPException(status_code=401, detail="Usuário não encontrado")
 
-    try: 
-        pwd_hasher.verify(usuario.senha_hash, user.senha)
-    except VerifyMismatchError:
+    senha_correta, novo_hash = await trabalho_senha(servico_senhas.verificar, usuario.senha_hash, user.senha)
+    if not senha_correta:
         raise HTTPException(status_code=401, detail="Senha incorreta")
 
+    # parâmetros do argon2 mudaram desde o cadastro: guarda o hash refeito
+    if novo_hash:
+        usuario.senha_hash = novo_hash
+        await db.commit()
+
     token = criar_token({"sub": usuario.email})
     return {"access_token": token, "token_type": "bearer"}
 
-@app.get("/origem-leads", response_model=list[schemas.LeadsResponse])
-def leads(
-    periodo: int = Query(6, description="Periodo em meses (3, 6 ou 12)"),
-    db: Session = Depends(get_db)
+# consulta e modelo de resposta de cada análise
+ANALISES = {
+    "origem-leads": (consultas.origem_leads, schemas.LeadsResponse),
+    "matricula-lead": (consultas.matricula_lead, schemas.MatriculasLeadsResponse),
+    "taxa-conversao": (consultas.taxa_conversao, schemas.TaxaConversaoResponse),
+    "inadimplencia": (consultas.inadimplencia, schemas.InadimplenciaResponse),
+}
+
+Granularidade = Literal["dia", "semana", "mes", "trimestre", "ano"]
+# séries com mais períodos que isso são recusadas (dez anos por dia)
+ANALISE_MAX_PERIODOS = int(os.getenv("ANALISE_MAX_PERIODOS", "3660"))
+
+
+def intervalo_analise(
+    periodo: int = Query(6, ge=1, le=1200, description="Periodo em meses (3, 6 ou 12), usado quando data_inicio não é informada"),
+    data_inicio: date | None = Query(None, description="Início do intervalo (padrão: periodo meses atrás)"),
+    data_fim: date | None = Query(None, description="Fim do intervalo (padrão: sem limite)"),
 ):
-    hoje = date.today()
-    meses = hoje.replace(day=1) - timedelta(days=30 * periodo)
-    
-    resultados = (
-        db.query(
-            models.Negociacao.origem_contato,
-            func.count(func.distinct(models.Negociacao.id)).label("quantidade")
-        )
-        .join(models.Calendario, models.Calendario.id == models.Negociacao.id_calendario_inicio)
-        .filter(
-            models.Calendario.data >= meses,
-            models.Calendario.data <= hoje
+    if data_inicio is None:
+        data_inicio = date.today().replace(day=1) - timedelta(days=30 * periodo)
+    if data_fim is not None and data_fim < data_inicio:
+        raise HTTPException(status_code=400, detail="data_fim anterior a data_inicio")
+    return data_inicio, data_fim
+
+
+def conferir_tamanho(intervalo, granularidade):
+    # a série densa tem um ponto por período do intervalo, mesmo sem dados
+    if granularidade is None:
+        return
+    if consultas.numero_periodos(*intervalo, granularidade) > ANALISE_MAX_PERIODOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"intervalo longo demais: até {ANALISE_MAX_PERIODOS} períodos com granularidade={granularidade}",
         )
-        .group_by(models.Negociacao.origem_contato)
-        .order_by(func.count(models.Negociacao.id).desc())
-        .all()
+
+
+def conferir_linhas(linhas, modelo):
+    # confere só a primeira linha contra o modelo: as demais saem da mesma
+    # consulta, com as mesmas chaves e tipos
+    if linhas:
+        if linhas[0].keys() != modelo.model_fields.keys():
+            raise ValueError(f"linhas fora do formato de {modelo.__name__}: {sorted(linhas[0])}")
+        modelo.model_validate(linhas[0])
+    return linhas
+
+
+def chave_analise(analise, intervalo, tempo_real, granularidade=None):
+    # hoje entra na chave porque intervalos abertos dependem da data atual
+    data_inicio, data_fim = intervalo
+    return (analise, data_inicio, data_fim, granularidade, tempo_real, date.today())
+
+
+async def calcular_analise(db, analise, intervalo, tempo_real, granularidade=None):
+    # (versão da carga, linhas); granularidade=None para análises que não são
+    # séries (origem-leads)
+    data_inicio, data_fim = intervalo
+    consulta, modelo = ANALISES[analise]
+    argumentos = {"granularidade": granularidade} if granularidade else {}
+
+    # com o cubo em memória carregado a resposta sai dele, sem banco nem cache
+    cubo_atual = servico_cubo.atual
+    if cubo_atual is not None:
+        linhas = cubo.ANALISES[analise](cubo_atual, data_inicio, data_fim, tempo_real, **argumentos)
+        return cubo_atual.versao, conferir_linhas(linhas, modelo)
+
+    # a conferência roda uma vez por cálculo; os acertos do cache já saem conferidos
+    return await cache_respostas.obter_ou_calcular(
+        db,
+        chave_analise(analise, intervalo, tempo_real, granularidade),
+        lambda s: conferir_linhas(consulta(s, data_inicio, data_fim, tempo_real, **argumentos), modelo),
     )
-    
-    resposta = [
-        {
-            "lead": r.origem_contato or "Não especificado",
-            "quantidade": int(r.quantidade or 0)
-        }
-        for r in resultados
-    ]
-    
+
+
+def etag_confere(request: Request, etag):
+    cabecalho = request.headers.get("if-none-match")
+    if not cabecalho:
+        return False
+    return any(valor.strip().removeprefix("W/") in (etag, "*") for valor in cabecalho.split(","))
+
+
+async def versao_atual(db):
+    # a do cubo em memória ou a guardada no cache, consultada no banco no
+    # máximo a cada CACHE_INTERVALO_VERSAO
+    cubo_atual = servico_cubo.atual
+    if cubo_atual is not None:
+        return cubo_atual.versao
+    return await cache_respostas.verificar_versao(db)
+
+
+async def resposta_condicional(request: Request, db, chave, gerar):
+    # o etag depende só da versão da carga e dos parâmetros: um If-None-Match
+    # que confere com a versão atual vira 304 sem consulta nem serialização.
+    # gerar devolve (versão, resposta), e o etag enviado é o da versão sob a
+    # qual a resposta foi calculada: uma resposta de uma carga anterior não
+    # leva o etag da atual
+    cabecalhos = {"ETag": cache.etag(await versao_atual(db), chave), "Cache-Control": "no-cache"}
+    if etag_confere(request, cabecalhos["ETag"]):
+        return Response(status_code=304, headers=cabecalhos)
+
+    versao, resposta = await gerar()
+    cabecalhos["ETag"] = cache.etag(versao, chave)
+    resposta.headers.update(cabecalhos)
     return resposta
 
+
+async def responder_analise(request: Request, db, analise, intervalo, tempo_real, granularidade=None):
+    conferir_tamanho(intervalo, granularidade)
+
+    async def gerar():
+        versao, linhas = await calcular_analise(db, analise, intervalo, tempo_real, granularidade)
+        return versao, ORJSONResponse(linhas)
+
+    chave = chave_analise(analise, intervalo, tempo_real, granularidade)
+    return await resposta_condicional(request, db, chave, gerar)
+
+# os endpoints analíticos devolvem a resposta já serializada com orjson: o
+# response_model continua documentando o openapi, mas o fastapi não valida
+# nem converte cada linha de novo
+
+@app.get("/origem-leads", response_model=list[schemas.LeadsResponse])
+async def leads(
+    request: Request,
+    intervalo: tuple = Depends(intervalo_analise),
+    tempo_real: bool = Query(False, description="Consultar as tabelas fato em vez das agregações mensais"),
+    db: AsyncSession = Depends(get_db_leitura)
+):
+    return await responder_analise(request, db, "origem-leads", intervalo, tempo_real)
+
 @app.get("/matricula-lead", response_model=list[schemas.MatriculasLeadsResponse])
-def matricula_lead(
-    periodo: int = Query(6, description="Periodo em meses (3, 6 ou 12)"),
-    db: Session = Depends(get_db)
+async def matricula_lead(
+    request: Request,
+    intervalo: tuple = Depends(intervalo_analise),
+    granularidade: Granularidade = Query("mes", description="Tamanho de cada período da série"),
+    tempo_real: bool = Query(False, description="Consultar as tabelas fato em vez das agregações mensais"),
+    db: AsyncSession = Depends(get_db_leitura)
 ):
-    hoje = date.today()
-    data_inicio = hoje.replace(day=1) - timedelta(days=30 * periodo)
-    
-    # leads por mês
-    leads = (
-        db.query(
-            models.Calendario.ano,
-            models.Calendario.mes,
-            models.Calendario.nome_mes,
-            func.count(func.distinct(models.Negociacao.id_cliente)).label("total_leads")
-        )
-        .join(models.Calendario, models.Calendario.id == models.Negociacao.id_calendario_inicio)
-        .filter(models.Calendario.data >= data_inicio)
-        .group_by(models.Calendario.ano, models.Calendario.mes, models.Calendario.nome_mes)
-        .all()
-    )
-    
-    # transformar em dicionário
-    leads_dict = {
-        (l.ano, l.mes): {
-            "ano": int(l.ano),
-            "mes": int(l.mes),
-            "nome_mes": l.nome_mes,
-            "total_leads": int(l.total_leads)
-        }
-        for l in leads
-    }
-    
-    # matriculas por mês
-    matriculas = (
-        db.query(
-            models.Calendario.ano,
-            models.Calendario.mes,
-            models.Calendario.nome_mes,
-            func.count(models.Negociacao.id).label("total_matriculas")
-        )
-        .join(
-            models.Negociacao,
-            models.Negociacao.id_calendario_inicio == models.Calendario.id
-        )
-        .filter(
-            models.Calendario.data >= data_inicio,
-            or_(
-                models.Negociacao.etapa_negociacao.like("NEGOCIA%"),
-                models.Negociacao.etapa_negociacao == "MATRICULADO"
-            )
-        )
-        .group_by(
-            models.Calendario.ano,
-            models.Calendario.mes,
-            models.Calendario.nome_mes
-        )
-        .order_by(
-            models.Calendario.ano.asc(),
-            models.Calendario.mes.asc()
-        )
-        .all()
-    )
-    
-    # juntar leads e matriculas
-    resposta_final = []
-    
-    for m in matriculas:
-        chave = (m.ano, m.mes)
-        
-        total_leads = leads_dict.get(chave, {}).get("total_leads", 0)
-        
-        resposta_final.append({
-            "ano": int(m.ano),
-            "mes": int(m.mes),
-            "nome_mes": m.nome_mes,
-            "total_leads": int(total_leads),
-            "total_matriculas": int(m.total_matriculas)
-        })
-        
-    return resposta_final
+    return await responder_analise(request, db, "matricula-lead", intervalo, tempo_real, granularidade)
 
 @app.get("/taxa-conversao", response_model=list[schemas.TaxaConversaoResponse])
-def taxa_conversao(
-    periodo: int = Query(6, description="Periodo em meses (3, 6 ou 12)"),
-    db: Session = Depends(get_db)
+async def taxa_conversao(
+    request: Request,
+    intervalo: tuple = Depends(intervalo_analise),
+    granularidade: Granularidade = Query("mes", description="Tamanho de cada período da série"),
+    tempo_real: bool = Query(False, description="Consultar as tabelas fato em vez das agregações mensais"),
+    db: AsyncSession = Depends(get_db_leitura)
 ):
-    hoje = date.today()
-    data_inicio = hoje.replace(day=1) - timedelta(days=30 * periodo)
-    
-    # leads por mês
-    leads = (
-        db.query(
-            models.Calendario.ano,
-            models.Calendario.mes,
-            models.Calendario.nome_mes,
-            func.count(func.distinct(models.Negociacao.id_cliente)).label("total_leads")
-        )
-        .join(models.Calendario, models.Calendario.id == models.Negociacao.id_calendario_inicio)
-        .filter(models.Calendario.data >= data_inicio)
-        .group_by(models.Calendario.ano, models.Calendario.mes, models.Calendario.nome_mes)
-        .all()
-    )
-    
-    leads_dict = {
-        (l.ano, l.mes): int(l.total_leads) for l in leads
-    }
-    
-    # matriculas pro mês
-    matriculas = (
-        db.query(
-            models.Calendario.ano,
-            models.Calendario.mes,
-            models.Calendario.nome_mes,
-            func.count(models.Negociacao.id).label("total_matriculas")
-        )
-        .join(models.Negociacao, models.Negociacao.id_calendario_inicio == models.Calendario.id)
-        .filter(
-            models.Calendario.data >= data_inicio,
-            or_(
-                models.Negociacao.etapa_negociacao.like("NEGOCIA%"),
-                models.Negociacao.etapa_negociacao == "MATRICULADO"
-            )
-        )
-        .group_by(models.Calendario.ano, models.Calendario.mes, models.Calendario.nome_mes)
-        .order_by(models.Calendario.ano.asc(), models.Calendario.mes.asc())
-        .all()
-    )
-    
-    resposta = []
-    for m in matriculas:
-        chave = (m.ano, m.mes)
-        total_leads = leads_dict.get(chave, 0)
-        total_matriculas = int(m.total_matriculas)
-        taxa = (total_matriculas / total_leads * 100) if total_leads > 0 else 0
-        
-        resposta.append({
-            "ano": int(m.ano),
-            "mes": int(m.mes),
-            "nome_mes": m.nome_mes,
-            "total_leads": total_leads,
-            "total_matriculas": total_matriculas,
-            "taxa_conversao": round(taxa, 2)
-        })
-    
-    return resposta
+    return await responder_analise(request, db, "taxa-conversao", intervalo, tempo_real, granularidade)
 
 @app.get("/inadimplencia", response_model=list[schemas.InadimplenciaResponse])
-def inadimplencia(
-    periodo: int = Query(6, description="Periodo em meses (3, 6, 12)"),
-    db: Session = Depends(get_db)
+async def inadimplencia(
+    request: Request,
+    intervalo: tuple = Depends(intervalo_analise),
+    granularidade: Granularidade = Query("mes", description="Tamanho de cada período da série"),
+    tempo_real: bool = Query(False, description="Consultar as tabelas fato em vez das agregações mensais"),
+    db: AsyncSession = Depends(get_db_leitura)
 ):
-    hoje = date.today()
-    data_inicio = hoje.replace(day=1) - timedelta(days=30 * periodo)
-    
-    resultados = (
-        db.query(
-            models.Calendario.ano,
-            models.Calendario.mes,
-            models.Calendario.nome_mes,
-            func.sum(models.Conta.valor).label("valor_total"),
-            func.sum(
-                case(
-                    (models.Conta.id_calendario_pagamento != None, models.Conta.valor),
-                    else_=0
-                )
-            ).label("receita_total"),
-            func.sum(
-                case(
-                    (models.Conta.id_calendario_pagamento == None, models.Conta.valor),
-                    else_=0
-                )
-            ).label("valor_inadimplente")
+    return await responder_analise(request, db, "inadimplencia", intervalo, tempo_real, granularidade)
+
+@app.get("/dashboard", response_model=schemas.DashboardResponse)
+async def dashboard(
+    request: Request,
+    intervalo: tuple = Depends(intervalo_analise),
+    granularidade: Granularidade = Query("mes", description="Tamanho de cada período das séries"),
+    tempo_real: bool = Query(False, description="Consultar as tabelas fato em vez das agregações mensais"),
+    db: AsyncSession = Depends(get_db_leitura)
+):
+    # as quatro análises numa sessão e numa transação só (ver consultas.dashboard)
+    conferir_tamanho(intervalo, granularidade)
+    data_inicio, data_fim = intervalo
+
+    def conferir(resultado):
+        for campo, linhas in resultado.items():
+            conferir_linhas(linhas, ANALISES[campo.replace("_", "-")][1])
+        return resultado
+
+    def calcular(s):
+        return conferir(consultas.dashboard(s, data_inicio, data_fim, tempo_real, granularidade))
+
+    chave = chave_analise("dashboard", intervalo, tempo_real, granularidade)
+
+    async def gerar():
+        cubo_atual = servico_cubo.atual
+        if cubo_atual is not None:
+            resultado = conferir(cubo_atual.dashboard(data_inicio, data_fim, tempo_real, granularidade))
+            return cubo_atual.versao, ORJSONResponse(resultado)
+        versao, resultado = await cache_respostas.obter_ou_calcular(db, chave, calcular)
+        return versao, ORJSONResponse(resultado)
+
+    return await resposta_condicional(request, db, chave, gerar)
+
+@app.get("/cache/estatisticas", response_model=schemas.CacheEstatisticasResponse)
+async def cache_estatisticas():
+    return cache_respostas.estatisticas()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def _cabecalhos_exportacao(nome, formato):
+    media_type, extensao = exportacao.FORMATOS[formato]
+    return media_type, {"Content-Disposition": f'attachment; filename="{nome}.{extensao}"'}
+
+@app.get("/exportar/{tabela}")
+async def exportar_tabela(
+    request: Request,
+    tabela: Literal["f_conta", "f_negociacao"],
+    formato: Literal["arrow", "parquet"] = Query("arrow", description="Arrow IPC stream ou Parquet"),
+    colunas: list[str] | None = Query(None, description="Colunas exportadas (padrão: todas)"),
+    data_inicio: date | None = Query(None, description="Início do filtro pela data de vencimento/início"),
+    data_fim: date | None = Query(None, description="Fim do filtro pela data de vencimento/início"),
+    db: AsyncSession = Depends(get_db_leitura)
+):
+    try:
+        stmt, schema = exportacao.consulta(tabela, colunas, data_inicio, data_fim)
+    except exportacao.ColunaInvalida as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    async def gerar():
+        # o gerador é síncrono: o starlette o consome numa thread, lote a lote.
+        # as linhas saem do banco durante o envio, de uma carga igual ou
+        # posterior à versão atual
+        media_type, cabecalhos = _cabecalhos_exportacao(tabela, formato)
+        return await versao_atual(db), StreamingResponse(
+            exportacao.serializar(exportacao.lotes(database.engine_leitura, stmt, schema), schema, formato),
+            media_type=media_type,
+            headers=cabecalhos,
         )
-        .join(models.Calendario, models.Calendario.id == models.Conta.id_calendario_vencimento)
-        .filter(models.Calendario.data >= data_inicio)
-        .group_by(models.Calendario.ano, models.Calendario.mes, models.Calendario.nome_mes)
-        .order_by(models.Calendario.ano.asc(), models.Calendario.mes.asc())
-        .all()
-    )
-    
-    resposta = []
-    for r in resultados:
-        valor_total = float(r.valor_total or 0)
-        receita_total = float(r.receita_total or 0)
-        valor_inadimplente = float(r.valor_inadimplente or 0)
-        
-        taxa_inadimplencia = (valor_inadimplente / valor_total * 100) if valor_total > 0 else 0
-        percentual_pagas = (receita_total / valor_total * 100) if valor_total > 0 else 0
-        
-        resposta.append({
-            "ano": int(r.ano),
-            "mes": int(r.mes),
-            "nome_mes": r.nome_mes,
-            "valor_total": valor_total,
-            "receita_total": receita_total,
-            "valor_inadimplente": valor_inadimplente,
-            "taxa_inadimplencia": round(taxa_inadimplencia, 2),
-            "percentual_mensalidades_pagas": round(percentual_pagas, 2)    
-        })
-        
-    return resposta
\ No newline at end of file
+
+    chave = ("exportar", tabela, formato, tuple(schema.names), data_inicio, data_fim)
+    return await resposta_condicional(request, db, chave, gerar)
+
+@app.get("/exportar/analises/{analise}")
+async def exportar_analise(
+    request: Request,
+    analise: Literal["origem-leads", "matricula-lead", "taxa-conversao", "inadimplencia"],
+    formato: Literal["arrow", "parquet"] = Query("arrow", description="Arrow IPC stream ou Parquet"),
+    intervalo: tuple = Depends(intervalo_analise),
+    granularidade: Granularidade = Query("mes", description="Tamanho de cada período da série (exceto origem-leads)"),
+    tempo_real: bool = Query(False, description="Consultar as tabelas fato em vez das agregações mensais"),
+    db: AsyncSession = Depends(get_db_leitura)
+):
+    # mesmos resultados (e mesmo cache) dos endpoints json
+    if analise == "origem-leads":
+        granularidade = None
+    conferir_tamanho(intervalo, granularidade)
+
+    async def gerar():
+        versao, linhas = await calcular_analise(db, analise, intervalo, tempo_real, granularidade)
+        tabela = exportacao.tabela_de_linhas(linhas, ANALISES[analise][1])
+
+        media_type, cabecalhos = _cabecalhos_exportacao(analise, formato)
+        conteudo = b"".join(exportacao.serializar(tabela.to_batches(), tabela.schema, formato))
+        return versao, Response(conteudo, media_type=media_type, headers=cabecalhos)
+
+    chave = ("exportar",) + chave_analise(analise, intervalo, tempo_real, granularidade) + (formato,)
+    return await resposta_condicional(request, db, chave, gerar)
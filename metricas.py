@@ -0,0 +1,148 @@
+import logging
+import os
+from time import perf_counter
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# consultas mais lentas que isso (em ms) vão para o log; 0 desliga
+DB_LOG_CONSULTAS_LENTAS_MS = float(os.getenv("DB_LOG_CONSULTAS_LENTAS_MS", "0"))
+
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_DB = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUISICAO_DURACAO = Histogram(
+    "http_requisicao_duracao_segundos",
+    "Duração das requisições por rota",
+    ["metodo", "rota", "status"],
+    buckets=BUCKETS_HTTP,
+)
+REQUISICOES_EM_ANDAMENTO = Gauge(
+    "http_requisicoes_em_andamento",
+    "Requisições em processamento por rota",
+    ["metodo", "rota"],
+)
+CONSULTA_DURACAO = Histogram(
+    "db_consulta_duracao_segundos",
+    "Duração de cada comando sql",
+    ["engine", "operacao"],
+    buckets=BUCKETS_DB,
+)
+CONSULTA_ERROS = Counter(
+    "db_consulta_erros_total",
+    "Comandos sql que terminaram em erro",
+    ["engine"],
+)
+POOL_ESPERA = Histogram(
+    "db_pool_espera_checkout_segundos",
+    "Tempo esperando uma conexão livre no pool",
+    ["engine"],
+    buckets=BUCKETS_DB,
+)
+
+
+# rotas
+
+
+def rota_da_requisicao(request):
+    # usa o caminho declarado (/itens/{id}) e não o da url, para não
+    # criar uma série por valor de parâmetro
+    for rota in request.app.router.routes:
+        correspondencia, _ = rota.matches(request.scope)
+        if correspondencia == Match.FULL:
+            return rota.path
+    return "nao_encontrada"
+
+
+async def medir_requisicao(request, call_next):
+    metodo = request.method
+    rota = rota_da_requisicao(request)
+    status = 500
+    em_andamento = REQUISICOES_EM_ANDAMENTO.labels(metodo, rota)
+    em_andamento.inc()
+    inicio = perf_counter()
+    try:
+        resposta = await call_next(request)
+        status = resposta.status_code
+        return resposta
+    finally:
+        REQUISICAO_DURACAO.labels(metodo, rota, str(status)).observe(perf_counter() - inicio)
+        em_andamento.dec()
+
+
+# banco de dados
+
+
+class _EsperaCheckout:
+    # mede quanto tempo cada checkout espera por uma conexão livre
+    def _do_get(self):
+        inicio = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_ESPERA.labels(self.logging_name or "padrao").observe(perf_counter() - inicio)
+
+
+class PoolMedido(_EsperaCheckout, QueuePool):
+    pass
+
+
+class PoolAssincronoMedido(_EsperaCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class _ColetorPools:
+    # tamanho e ocupação dos pools, lidos no momento da coleta
+    def __init__(self):
+        self.engines = {}
+
+    def collect(self):
+        metrica = GaugeMetricFamily(
+            "db_pool_conexoes", "Conexões dos pools por estado", labels=["engine", "estado"]
+        )
+        for nome, engine in self.engines.items():
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            metrica.add_metric([nome, "tamanho"], pool.size())
+            metrica.add_metric([nome, "em_uso"], pool.checkedout())
+            metrica.add_metric([nome, "ociosas"], pool.checkedin())
+            metrica.add_metric([nome, "overflow"], max(pool.overflow(), 0))
+        yield metrica
+
+
+coletor_pools = _ColetorPools()
+REGISTRY.register(coletor_pools)
+
+
+def _operacao(statement):
+    partes = statement.lstrip().split(None, 1)
+    return partes[0].upper() if partes else "VAZIO"
+
+
+def instrumentar_engine(engine, nome):
+    # engine síncrona; para a AsyncEngine passe async_engine.sync_engine
+    coletor_pools.engines[nome] = engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("inicio_consultas", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def depois(conn, cursor, statement, parameters, context, executemany):
+        duracao = perf_counter() - conn.info["inicio_consultas"].pop()
+        CONSULTA_DURACAO.labels(nome, _operacao(statement)).observe(duracao)
+        if DB_LOG_CONSULTAS_LENTAS_MS and duracao * 1000 >= DB_LOG_CONSULTAS_LENTAS_MS:
+            logger.warning("consulta lenta (%.1f ms) em %s: %s %r", duracao * 1000, nome, statement, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def erro(contexto):
+        CONSULTA_ERROS.labels(nome).inc()
+        conexao = contexto.connection
+        if conexao is not None and conexao.info.get("inicio_consultas"):
+            conexao.info["inicio_consultas"].pop()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Double, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, Text, Double, ForeignKey, Date, DateTime
 from .database import Base
 
 class Usuario(Base):
@@ -44,15 +44,67 @@ class Negociacao(Base):
     id = Column(Integer, primary_key=True, index=True)
     id_cliente = Column(Integer)
     id_vendedor = Column(Integer)
-    id_produto = Column(Integer)
-    atividade_negociacao = Column(Text)
     etapa_negociacao = Column(Text)
     origem_contato = Column(Text)
-    tipo_atividade = Column(Text)
-    quantidade_produto = Column(Integer)
     id_calendario_inicio = Column(Integer, ForeignKey("d_calendario.id"))
-    id_calendario_fechamento = Column(Integer, ForeignKey("d_calendario"))
+    id_calendario_fechamento = Column(Integer, ForeignKey("d_calendario.id"))
     id_calendario_fechamento_esperada = Column(Integer, ForeignKey("d_calendario.id"))
+
+class NegociacaoAtividade(Base):
+    __tablename__ = "f_negociacao_atividade"
+
+    id = Column(Integer, primary_key=True, index=True)
+    id_negociacao = Column(Integer, ForeignKey("f_negociacao.id"), index=True)
+    atividade_negociacao = Column(Text)
+    tipo_atividade = Column(Text)
+    horario_inicial = Column(DateTime)
+    horario_final = Column(DateTime)
     id_horario_inicial = Column(Integer, ForeignKey("d_calendario.id"))
     id_horario_final = Column(Integer, ForeignKey("d_calendario.id"))
-    valor_produto = Column(Double)
\ No newline at end of file
+
+class NegociacaoItem(Base):
+    __tablename__ = "f_negociacao_item"
+
+    id = Column(Integer, primary_key=True, index=True)
+    id_negociacao = Column(Integer, ForeignKey("f_negociacao.id"), index=True)
+    id_produto = Column(Integer)
+    quantidade_produto = Column(Double)
+    valor_produto = Column(Double)
+
+class NegociacaoMensal(Base):
+    __tablename__ = "r_negociacao_mensal"
+
+    ano = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    nome_mes = Column(Text)
+    total_negociacoes = Column(Integer)
+    total_clientes = Column(Integer)
+    total_matriculas = Column(Integer)
+
+class NegociacaoOrigemMensal(Base):
+    __tablename__ = "r_negociacao_origem_mensal"
+
+    ano = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    origem_contato = Column(Text, primary_key=True)
+    nome_mes = Column(Text)
+    total_negociacoes = Column(Integer)
+    total_clientes = Column(Integer)
+    total_matriculas = Column(Integer)
+
+class ContaMensal(Base):
+    __tablename__ = "r_conta_mensal"
+
+    ano = Column(Integer, primary_key=True)
+    mes = Column(Integer, primary_key=True)
+    nome_mes = Column(Text)
+    valor_total = Column(Double)
+    receita_total = Column(Double)
+    valor_inadimplente = Column(Double)
+
+class CargaWarehouse(Base):
+    __tablename__ = "etl_carga"
+
+    id = Column(Integer, primary_key=True, index=True)
+    iniciada_em = Column(DateTime, nullable=False)
+    finalizada_em = Column(DateTime, nullable=False)
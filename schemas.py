@@ -1,3 +1,4 @@
+from datetime import date
 from pydantic import BaseModel, EmailStr
 
 class UsuarioCreate(BaseModel):
@@ -32,6 +33,7 @@ class LeadsResponse(BaseModel):
         from_attributes = True
         
 class MatriculasLeadsResponse(BaseModel):
+    inicio: date
     ano: int
     mes: int
     nome_mes: str
@@ -42,6 +44,7 @@ class MatriculasLeadsResponse(BaseModel):
         from_attributes = True
         
 class TaxaConversaoResponse(BaseModel):
+    inicio: date
     ano: int
     mes: int
     nome_mes: str
@@ -53,6 +56,7 @@ class TaxaConversaoResponse(BaseModel):
         from_attributes = True
         
 class InadimplenciaResponse(BaseModel):
+    inicio: date
     ano: int
     mes: int
     nome_mes: str
@@ -64,6 +68,23 @@ class InadimplenciaResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class DashboardResponse(BaseModel):
+    origem_leads: list[LeadsResponse]
+    matricula_lead: list[MatriculasLeadsResponse]
+    taxa_conversao: list[TaxaConversaoResponse]
+    inadimplencia: list[InadimplenciaResponse]
+
+class CacheEstatisticasResponse(BaseModel):
+    versao_carga: int | None
+    itens: int
+    max_itens: int
+    ttl: int
+    hits: int
+    misses: int
+    invalidacoes: int
+    coalescidas: int
+    taxa_acerto: float
                 
 """        
 class LucroMensalResponse(BaseModel):
@@ -0,0 +1,124 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+
+# custo do argon2; ao mudar, os hashes antigos são refeitos no próximo login
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# processos dedicados ao hash e quantas requisições podem esperar por eles
+SENHAS_WORKERS = int(os.getenv("SENHAS_WORKERS", str(max((os.cpu_count() or 2) // 2, 1))))
+SENHAS_MAX_FILA = int(os.getenv("SENHAS_MAX_FILA", "32"))
+
+
+class FilaCheia(Exception):
+    pass
+
+
+class PoolIndisponivel(Exception):
+    pass
+
+
+# executadas nos processos do pool
+
+
+@lru_cache(maxsize=None)
+def _hasher(time_cost, memory_cost, parallelism):
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+
+def _gerar_hash(parametros, senha):
+    return _hasher(*parametros).hash(senha)
+
+
+def _verificar(parametros, senha_hash, senha):
+    # devolve (senha confere, novo hash quando os parâmetros mudaram)
+    hasher = _hasher(*parametros)
+    try:
+        hasher.verify(senha_hash, senha)
+    except VerifyMismatchError:
+        return False, None
+    if hasher.check_needs_rehash(senha_hash):
+        return True, hasher.hash(senha)
+    return True, None
+
+
+class ServicoSenhas:
+    # hash e verificação de senhas num pool de processos, fora do event loop e
+    # das threads que atendem as consultas analíticas
+
+    def __init__(
+        self,
+        workers=SENHAS_WORKERS,
+        max_fila=SENHAS_MAX_FILA,
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+    ):
+        self.workers = workers
+        self.max_fila = max_fila
+        self.parametros = (time_cost, memory_cost, parallelism)
+        self.pendentes = 0
+        self.recusadas = 0
+        self.reinicios = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: o processo da api tem threads, e fork com threads não é seguro
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _reiniciar(self, executor):
+        # um worker que morre (oom, sinal) quebra o pool inteiro: descarta-o
+        # para que o próximo _pool() crie outro. várias requisições falham
+        # juntas com o mesmo pool, mas só a primeira o troca
+        with self._lock:
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.reinicios += 1
+
+    async def _executar(self, funcao, *args):
+        # até `workers` tarefas rodando e `max_fila` esperando; além disso, recusa
+        if self.pendentes >= self.workers + self.max_fila:
+            self.recusadas += 1
+            raise FilaCheia()
+
+        self.pendentes += 1
+        try:
+            # com o pool quebrado, tenta uma vez num pool novo
+            loop = asyncio.get_running_loop()
+            for _ in range(2):
+                executor = self._pool()
+                try:
+                    return await loop.run_in_executor(executor, funcao, self.parametros, *args)
+                except BrokenProcessPool:
+                    self._reiniciar(executor)
+            raise PoolIndisponivel()
+        finally:
+            self.pendentes -= 1
+
+    async def gerar_hash(self, senha):
+        return await self._executar(_gerar_hash, senha)
+
+    async def verificar(self, senha_hash, senha):
+        return await self._executar(_verificar, senha_hash, senha)
+
+    def encerrar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None